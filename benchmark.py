@@ -0,0 +1,203 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tracemalloc
+import datetime
+import subprocess
+
+# Run against a throwaway schema, never the production one
+os.environ.setdefault('DB_SCHEMA', 'assam_procurements_bench')
+
+from botocore.exceptions import ClientError
+
+import db
+import prefect_code
+from metrics import PeakMemory
+from river_registry import river_registry
+from synthetic_tenders import write_tenders_csv
+
+
+SIZES = [10000, 100000, 1000000]
+
+
+class LocalS3:
+    # Filesystem-backed stand-in for the parts of the boto3 S3 resource the pipeline uses
+    def __init__(self, root):
+        self.root = root
+
+    def Object(self, bucket, key):
+        return LocalObject(os.path.join(self.root, bucket, key))
+
+    def Bucket(self, bucket):
+        return LocalBucket(os.path.join(self.root, bucket))
+
+
+class LocalBucket:
+    def __init__(self, path):
+        self.path = path
+        self.objects = self
+
+    def filter(self, Prefix=''):
+        keys = [os.path.relpath(os.path.join(root, name), self.path).replace(os.sep, '/')
+                for root, _, names in os.walk(self.path) for name in names]
+        return [LocalObject(os.path.join(self.path, key), key) for key in sorted(keys) if key.startswith(Prefix)]
+
+
+class LocalObject:
+    def __init__(self, path, key=None):
+        self.path = path
+        self.key = key
+
+    def load(self):
+        if not os.path.exists(self.path):
+            raise ClientError({'Error': {'Code': '404'}}, 'HeadObject')
+
+    def get(self):
+        return {'Body': open(self.path, 'rb'), 'ContentLength': os.path.getsize(self.path)}
+
+    def put(self, Body):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, 'wb') as f:
+            f.write(Body if isinstance(Body, bytes) else Body.read())
+
+
+def measure(results, stage, rows, fn, *args):
+    with PeakMemory() as memory:
+        start = time.perf_counter()
+        output = fn(*args)
+        seconds = time.perf_counter() - start
+    results.append({'stage': stage, 'rows': int(rows), 'seconds': round(seconds, 4),
+                    'rows_per_sec': round(rows / seconds, 1) if seconds else None,
+                    'peak_rss_mb': round(memory.peak / 2 ** 20, 1)})
+    print('  {:<30} {:>10} rows {:>9.2f}s {:>12.0f} rows/s {:>9.1f} MB'.format(
+        stage, rows, seconds, rows / seconds if seconds else 0, memory.peak / 2 ** 20))
+    return output
+
+
+def reset_schema():
+    with db.get_connection() as conn:
+        conn.cursor().execute('DROP SCHEMA IF EXISTS {} CASCADE;'.format(db.SCHEMA_NAME))
+    river_registry.clear()
+
+
+def run_pipeline(s3_key, n_rows):
+    # Runs each my_etl task in flow order on a fresh schema and measures it
+    results = []
+    reset_schema()
+    staged = measure(results, 'stage_parquet', n_rows, prefect_code.stage_parquet.run, [s3_key])
+    df = measure(results, 'extract_from_s3', n_rows, prefect_code.extract_from_s3.run, staged)
+    df_static, cols_table_1, df_updates, cols_table_2 = measure(
+        results, 'transform_into_schema', len(df), prefect_code.transform_into_schema.run, df)
+    measure(results, 'load_to_db_static', len(df_static), prefect_code.load_to_db_static.run, df_static, cols_table_1)
+    measure(results, 'load_to_db_updates', len(df_updates), prefect_code.load_to_db_updates.run,
+            df_updates, cols_table_2)
+    flood_df, high_water_mark, previous_state = measure(results, 'identify_flood_tenders', len(df_static),
+                                                        prefect_code.identify_flood_tenders.run)
+    measure(results, 'create_tender_flood_table', len(flood_df), prefect_code.create_tender_flood_table.run,
+            flood_df, high_water_mark, previous_state)
+    river_names_std = measure(results, 'standardise_river_names', len(flood_df),
+                              prefect_code.standardise_river_names.run)
+    measure(results, 'create_assam_rivers_table', len(river_names_std), prefect_code.create_assam_rivers_table.run,
+            river_names_std)
+    tender_river_df = measure(results, 'identify_river_from_title', len(flood_df),
+                              prefect_code.identify_river_from_title.run)
+    measure(results, 'create_tender_river_table', len(tender_river_df), prefect_code.create_tender_river_table.run,
+            tender_river_df)
+    measure(results, 'update_flood_rollups', len(flood_df), prefect_code.update_flood_rollups.run)
+    measure(results, 'refresh_read_models', len(flood_df), prefect_code.refresh_read_models.run)
+    return results
+
+
+def frame_mb(*frames):
+    return sum(df.memory_usage(deep=True).sum() for df in frames) / 2 ** 20
+
+
+def read_and_transform(s3_key):
+    start = time.perf_counter()
+    df = prefect_code.read_tenders(s3_key)
+    read_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    df_static, _, df_updates, _ = prefect_code.transform_into_schema.run(df)
+    return df, df_static, df_updates, read_seconds, time.perf_counter() - start
+
+
+def load_profile_report(s3_key, n_rows):
+    # Parse + transform time and memory of the raw CSV read untyped and with the typed load profile.
+    # Times come from a plain run; the allocation peak from a second one under tracemalloc, which follows
+    # numpy and Python string allocations, so it doesn't depend on what ran before but slows the run down.
+    typed_load = prefect_code.TYPED_LOAD
+    try:
+        for typed in (False, True):
+            prefect_code.TYPED_LOAD = typed
+            df, df_static, df_updates, read_seconds, transform_seconds = read_and_transform(s3_key)
+            sizes = frame_mb(df), frame_mb(df_static, df_updates)
+            del df, df_static, df_updates
+            tracemalloc.start()
+            read_and_transform(s3_key)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print('  {:<30} {:>10} rows {:>7.2f}s read {:>7.2f}s transform {:>8.1f} MB frame {:>8.1f} MB split'
+                  ' {:>8.1f} MB peak'.format('typed' if typed else 'untyped', n_rows, read_seconds, transform_seconds,
+                                             sizes[0], sizes[1], peak / 2 ** 20))
+    finally:
+        prefect_code.TYPED_LOAD = typed_load
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def previous_results(path):
+    previous = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                record = json.loads(line)
+                previous[(record['size'], record['stage'])] = record
+    return previous
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the my_etl tasks on synthetic tender data')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES)
+    parser.add_argument('--data-dir', default='bench_data', help='where the synthetic CSVs are kept')
+    parser.add_argument('--output', default='benchmark_results.jsonl', help='results are appended here')
+    parser.add_argument('--load-profile', action='store_true',
+                        help='compare reading the CSVs with and without the typed load profile instead')
+    args = parser.parse_args()
+
+    if db.SCHEMA_NAME == 'assam_procurements':
+        sys.exit('Refusing to benchmark against the production schema; set DB_SCHEMA')
+
+    prefect_code.s3 = LocalS3(args.data_dir)
+    os.makedirs(os.path.join(args.data_dir, prefect_code.S3_BUCKET), exist_ok=True)
+    previous = previous_results(args.output)
+    revision = git_revision()
+    run_at = datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+    with open(args.output, 'a') as out:
+        for size in args.sizes:
+            s3_key = 'synthetic_{}.csv'.format(size)
+            path = os.path.join(args.data_dir, prefect_code.S3_BUCKET, s3_key)
+            if not os.path.exists(path):
+                write_tenders_csv(path, size)
+
+            print('{} rows'.format(size))
+            if args.load_profile:
+                load_profile_report(s3_key, size)
+                continue
+            for result in run_pipeline(s3_key, size):
+                before = previous.get((size, result['stage']))
+                if before and before['seconds']:
+                    change = 100.0 * (result['seconds'] - before['seconds']) / before['seconds']
+                    print('  {:<30} {:+.1f}% vs {}'.format(result['stage'], change, before.get('revision')))
+                out.write(json.dumps(dict(result, size=size, revision=revision, run_at=run_at)) + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+import re
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+
+from titles import REPLACEMENTS
+
+
+# Keywords to identify flood related tenders
+POSITIVE_KW = ['Flood', 'Embankment', 'embkt', 'Relief', 'Erosion', 'SDRF', 'River', 'Inundation', 'Hydrology',
+               'Silt', 'Siltation', 'Bund', 'Trench', 'Drain', 'Culvert', 'Sluice', 'Bridge', 'Dyke',
+               'Storm water drain']
+NEGATIVE_KW = ['Driver', 'Floodlight', 'Flood Light']
+# Columns identify_flood_tenders classifies; title_words are the titles after titles.REPLACEMENTS
+FLOOD_FIELDS = ['title_words', 'tender_externalreference']
+
+
+def normalise_keyword(text):
+    return ' '.join(text.lower().split())
+
+
+def keyword_pattern(keywords):
+    # Whole words/phrases only, longest first so a phrase wins over the shorter keywords it contains.
+    # Any run of whitespace may separate the words of a phrase.
+    keywords = sorted(keywords, key=len, reverse=True)
+    phrases = ['\\s+'.join(re.escape(word) for word in kw.split()) for kw in keywords]
+    return re.compile(r'\b(?:{})\b'.format('|'.join(phrases)))
+
+
+# Bytes that re's \w matches in lower-case ASCII text
+WORD_BYTES = np.zeros(256, dtype=bool)
+WORD_BYTES[list(b'abcdefghijklmnopqrstuvwxyz0123456789_')] = True
+WORD_PATTERN = re.compile(r'\w+')
+TOKEN_BYTES = 16  # words up to this long are compared as two little-endian uint64
+CHUNK_SIZE = 65536  # texts tokenised at once, bounds the temporary arrays
+
+
+def packed_words(buf, starts, lengths):
+    # The first TOKEN_BYTES bytes of each word in buf as two uint64, with the bytes past its end zeroed.
+    # Words don't contain zero bytes, so equal keys mean equal words.
+    padded = np.concatenate((buf, np.zeros(TOKEN_BYTES, dtype=np.uint8)))
+    # Unaligned uint64 at every byte offset of buf and of the padding after it
+    at = np.ndarray((len(buf) + TOKEN_BYTES // 2,), dtype='<u8', buffer=padded, strides=(1,))
+    masks = np.array([(1 << (8 * n)) - 1 for n in range(9)], dtype=np.uint64)
+    lo = at[starts] & masks[np.minimum(lengths, 8)]
+    hi = at[starts + 8] & masks[np.clip(lengths - 8, 0, 8)]
+    return lo, hi
+
+
+def word_keys(lo, hi):
+    # One uint64 per word for searchsorted; equal lo and hi are checked separately
+    return lo ^ (hi * np.uint64(0x9E3779B97F4A7C15))
+
+
+class KeywordClassifier:
+    # Scores text Series against a positive and a negative keyword set.
+    # A row is a match when any field hits a positive keyword and no field hits a negative one.
+    # Each distinct text is scored once. Single-word keywords are found by comparing the words of the text
+    # with them in numpy; phrases run their own regex, on the texts that contain the phrase's first word.
+    # Matching is the same as the whole-word regexes in match(): words are runs of re's \w, and the
+    # words of a phrase may be separated by any whitespace.
+    # `fields` are the columns classify_frame() reads and `normalisation` is whatever shaped their text before it
+    # got here; both go into the version, so a stored classification is redone when either changes.
+    def __init__(self, positive, negative, fields=(), normalisation=()):
+        self.positive = list(dict.fromkeys(normalise_keyword(kw) for kw in positive))
+        self.negative = list(dict.fromkeys(normalise_keyword(kw) for kw in negative))
+        self.keywords = list(dict.fromkeys(self.positive + self.negative))
+        self.fields = list(fields)
+        self.version = hashlib.sha1(json.dumps([self.positive, self.negative, self.fields, normalisation])
+                                    .encode('utf-8')).hexdigest()[:12]
+
+        self.positive_pattern = keyword_pattern(self.positive)
+        self.negative_pattern = keyword_pattern(self.negative)
+        self.pattern = keyword_pattern(self.keywords)
+        # Matches don't overlap, so a phrase also counts as a hit for every keyword inside it
+        # (e.g. 'storm water drain' -> 'drain', 'flood light' -> 'flood').
+        self.codes = {kw: [i for i, other in enumerate(self.keywords) if keyword_pattern([other]).search(kw)]
+                      for kw in self.keywords}
+        self.is_positive = np.array([kw in self.positive for kw in self.keywords])
+        self.is_negative = np.array([kw in self.negative for kw in self.keywords])
+
+        # Words to look for: every single-word keyword, and the first word of every other keyword.
+        # A keyword that doesn't start with a word is searched for in every text.
+        self.words = []
+        self.word_keywords = []  # (keyword, word) for single-word keywords
+        self.phrases = []  # (keyword, pattern, first word or None)
+        for i, kw in enumerate(self.keywords):
+            first = WORD_PATTERN.match(kw)
+            word = first.group() if first and first.group().isascii() and len(first.group()) <= TOKEN_BYTES else None
+            if word is not None and word not in self.words:
+                self.words.append(word)
+            if word == kw:
+                self.word_keywords.append((i, self.words.index(word)))
+            else:
+                self.phrases.append((i, keyword_pattern([kw]), None if word is None else self.words.index(word)))
+
+        encoded = np.frombuffer(' '.join(self.words).encode('ascii'), dtype=np.uint8)
+        lengths = np.array([len(word) for word in self.words], dtype=np.int64)
+        starts = np.concatenate(([0], np.cumsum(lengths + 1)[:-1])).astype(np.int64)
+        lo, hi = packed_words(encoded, starts, lengths)
+        keys = word_keys(lo, hi)
+        self.word_order = np.argsort(keys, kind='stable')
+        self.word_lo, self.word_hi, self.sorted_keys = lo[self.word_order], hi[self.word_order], keys[self.word_order]
+        self.word_lengths = np.unique(lengths)
+
+    def _ascii_words(self, texts):
+        # Which of self.words occur in each of the ASCII texts, as a len(texts) x len(self.words) array
+        found = np.zeros((len(texts), len(self.words)), dtype=bool)
+        if not texts or not self.words:
+            return found
+        lengths = np.fromiter(map(len, texts), dtype=np.int64, count=len(texts))
+        ends = np.cumsum(lengths + 1)  # each text is followed by a '\n', which is not a word byte
+        buf = np.frombuffer(('\n'.join(texts) + '\n').lower().encode('ascii'), dtype=np.uint8)
+        edges = np.flatnonzero(np.diff(WORD_BYTES[buf].view(np.int8), prepend=np.int8(0), append=np.int8(0)))
+        starts, sizes = edges[::2], edges[1::2] - edges[::2]
+        keep = np.isin(sizes, self.word_lengths)
+        starts, sizes = starts[keep], sizes[keep]
+
+        lo, hi = packed_words(buf, starts, sizes)
+        position = np.minimum(np.searchsorted(self.sorted_keys, word_keys(lo, hi)), len(self.words) - 1)
+        matched = (self.word_lo[position] == lo) & (self.word_hi[position] == hi)
+        rows = np.searchsorted(ends, starts[matched], side='right')
+        found[rows, self.word_order[position[matched]]] = True
+        return found
+
+    def _text_words(self, texts):
+        # Same as _ascii_words, for any text
+        found = np.zeros((len(texts), len(self.words)), dtype=bool)
+        is_ascii = np.fromiter((text.isascii() for text in texts), dtype=bool, count=len(texts))
+        ascii_rows = np.flatnonzero(is_ascii)
+        for start in range(0, len(ascii_rows), CHUNK_SIZE):
+            rows = ascii_rows[start:start + CHUNK_SIZE]
+            found[rows] = self._ascii_words([texts[row] for row in rows])
+        lookup = {word: i for i, word in enumerate(self.words)}
+        for row in np.flatnonzero(~is_ascii):
+            for word in set(WORD_PATTERN.findall(texts[row].lower())):
+                if word in lookup:
+                    found[row, lookup[word]] = True
+        return found
+
+    def _distinct_hits(self, field):
+        # Per-keyword hits of every distinct value of a field, and the position of each row's value among them.
+        # Missing values point at an extra row without hits.
+        codes, uniques = pd.factorize(pd.Series(field), sort=False)
+        texts = [str(value) for value in uniques]
+        found = self._text_words(texts)
+        hits = np.zeros((len(texts) + 1, len(self.keywords)), dtype=bool)
+        for keyword, word in self.word_keywords:
+            hits[:len(texts), keyword] = found[:, word]
+        for keyword, pattern, word in self.phrases:
+            candidates = range(len(texts)) if word is None else np.flatnonzero(found[:, word])
+            for row in candidates:
+                if pattern.search(texts[row].lower()):
+                    hits[row, keyword] = True
+        return hits, codes
+
+    def classify(self, *fields):
+        index = pd.Series(fields[0]).index
+        positive = np.zeros(len(index), dtype=bool)
+        negative = np.zeros(len(index), dtype=bool)
+        for field in fields:
+            hits, codes = self._distinct_hits(field)
+            positive |= hits[:, self.is_positive].any(axis=1)[codes]
+            negative |= hits[:, self.is_negative].any(axis=1)[codes]
+        return pd.Series(positive & ~negative, index=index)
+
+    def classify_frame(self, df):
+        return self.classify(*(df[field] for field in self.fields))
+
+    def hits(self, *fields):
+        # One boolean column per keyword, True when the keyword occurs in any of the fields
+        index = pd.Series(fields[0]).index
+        hits = np.zeros((len(index), len(self.keywords)), dtype=bool)
+        for field in fields:
+            distinct, codes = self._distinct_hits(field)
+            hits |= distinct[codes]
+        return pd.DataFrame(hits, index=index, columns=self.keywords)
+
+    def match(self, *fields):
+        # classify() and hits() for a single row without going through pandas: (is a match, keywords found)
+        text = ' | '.join('' if field is None else str(field) for field in fields).lower()
+        found = bool(self.positive_pattern.search(text)) and not self.negative_pattern.search(text)
+        codes = {code for match in self.pattern.findall(text) for code in self.codes[normalise_keyword(match)]}
+        return found, [self.keywords[code] for code in sorted(codes)]
+
+
+flood_classifier = KeywordClassifier(POSITIVE_KW, NEGATIVE_KW, fields=FLOOD_FIELDS, normalisation=REPLACEMENTS)
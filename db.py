@@ -0,0 +1,142 @@
+import os
+import time
+import logging
+import select
+import threading
+from contextlib import contextmanager
+from decouple import config
+import psycopg2
+from psycopg2.extensions import cursor
+from psycopg2.pool import ThreadedConnectionPool
+import metrics
+
+
+DB_HOST = config('DB_HOST')
+DB_NAME = config('DB_NAME')
+DB_USER = config('DB_USER')
+DB_PASS = config('DB_PASS')
+DB_POOL_SIZE = config('DB_POOL_SIZE', default=8, cast=int)
+
+SCHEMA_NAME = config('DB_SCHEMA', default='assam_procurements')
+
+# search_path is set once per session as a startup option instead of a SET per task
+CONNECT_KWARGS = dict(dbname=DB_NAME, user=DB_USER, password=DB_PASS, host=DB_HOST, port=5432,
+                      options='-c search_path={}'.format(SCHEMA_NAME))
+
+
+class CountingCursor(cursor):
+    # Counts the statements sent to Postgres towards the metrics of the running task
+    def execute(self, query, vars=None):
+        metrics.add('db_round_trips')
+        return super().execute(query, vars)
+
+    def executemany(self, query, vars_list):
+        metrics.add('db_round_trips')
+        return super().executemany(query, vars_list)
+
+    def copy_expert(self, sql, file, size=8192):
+        metrics.add('db_round_trips')
+        return super().copy_expert(sql, file, size)
+
+
+class TimedConnectionPool(ThreadedConnectionPool):
+    # Keeps track of how often a new connection had to be opened vs. reused from the pool
+    def __init__(self, *args, **kwargs):
+        self.connects = 0
+        self.connect_seconds = 0.0
+        self.checkouts = 0
+        super().__init__(*args, **kwargs)
+
+    def _connect(self, key=None):
+        start = time.perf_counter()
+        conn = super()._connect(key)
+        self.connect_seconds += time.perf_counter() - start
+        self.connects += 1
+        return conn
+
+    def getconn(self, key=None):
+        self.checkouts += 1
+        return super().getconn(key)
+
+    def stats(self):
+        avg_connect = self.connect_seconds / self.connects if self.connects else 0.0
+        reused = self.checkouts - self.connects
+        return {'checkouts': self.checkouts,
+                'connects': self.connects,
+                'connect_seconds': round(self.connect_seconds, 4),
+                'saved_seconds': round(reused * avg_connect, 4)}
+
+
+_pool = None
+_pool_pid = None
+# ThreadedConnectionPool.getconn raises PoolError when every connection is out instead of waiting, and the
+# API runs sync handlers on more threads than DB_POOL_SIZE: callers queue here for a free connection
+_slots = None
+_pool_lock = threading.Lock()  # threads that start together must end up with the same pool
+
+
+def get_pool():
+    global _pool, _pool_pid, _slots
+    # A pool must not be shared across forked processes
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = TimedConnectionPool(1, DB_POOL_SIZE, cursor_factory=CountingCursor, **CONNECT_KWARGS)
+            _slots = threading.BoundedSemaphore(DB_POOL_SIZE)
+            _pool_pid = os.getpid()
+        return _pool
+
+
+@contextmanager
+def get_connection():
+    # Borrow a pooled connection, waiting for one if they are all in use; commit on success, roll back on
+    # error, and always hand it back
+    pool = get_pool()
+    slots = _slots  # this pool's semaphore
+    slots.acquire()
+    try:
+        conn = pool.getconn()
+    except Exception:
+        slots.release()
+        raise
+    try:
+        yield conn
+        conn.commit()
+    except Exception:
+        if not conn.closed:
+            conn.rollback()
+        raise
+    finally:
+        pool.putconn(conn, close=bool(conn.closed))
+        slots.release()
+
+
+def pool_stats():
+    return _pool.stats() if _pool is not None else {}
+
+
+def listen(channel, callback, timeout=5.0):
+    # Calls callback(payload) for every NOTIFY on `channel`, from a daemon thread with its own connection.
+    # callback(None) is called on every (re)connect, since notifications sent while disconnected are lost.
+    # A failing callback is logged and handled like a lost connection, so the thread never stops listening.
+    def run():
+        while True:
+            conn = None
+            try:
+                conn = psycopg2.connect(**CONNECT_KWARGS)
+                conn.autocommit = True
+                conn.cursor().execute('LISTEN {};'.format(channel))
+                callback(None)
+                while True:
+                    if select.select([conn], [], [], timeout) != ([], [], []):
+                        conn.poll()
+                        while conn.notifies:
+                            callback(conn.notifies.pop(0).payload)
+            except Exception:
+                logging.getLogger(__name__).exception('Listening on %s failed; reconnecting', channel)
+                if conn is not None:
+                    conn.close()
+                time.sleep(timeout)
+
+    thread = threading.Thread(target=run, name='listen-{}'.format(channel), daemon=True)
+    thread.start()
+    return thread
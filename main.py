@@ -1,16 +1,28 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Query
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import PlainTextResponse
+from starlette.concurrency import run_in_threadpool
 import uvicorn
 import psycopg2
 import glob
-import shutil
-import os
+import hashlib
 from decouple import config
 import boto3
+from botocore.exceptions import ClientError
+from multipart.multipart import MultipartParser, parse_options_header
 import pandas as pd
 import pandas.io.sql as psql
-from typing import List
+from typing import List, Optional, Union
+from pydantic import BaseModel
+import datetime
 import numpy as np
 from fuzzywuzzy import fuzz
+import metrics
+from metrics import instrumented
+from manifest import reserve_key, claim_upload, release_upload, advance
+import db
+import read_models
+from river_registry import RIVERS_CHANNEL
+from tender_classifier import tender_classifier, CLASSIFY_MAX_BATCH
 
 
 AWS_ACCESS_KEY_ID = config('AWS_ACCESS_KEY_ID')
@@ -24,49 +36,225 @@ pos_kw = ['Flood', 'Embankment', 'embkt', 'Relief', 'Erosion', 'SDRF', 'River',
                    'Silt', 'Siltation', 'Bund', 'Trench', 'Drain', 'Culvert', 'Sluice', 'Bridge', 'Dyke',
                    'Storm water drain']
 neg_kw = ['Driver', 'Floodlight', 'Flood Light']
-cwd = os.getcwd()
+
+S3_BUCKET = 'assamtenders'
+PART_SIZE = 8 * 1024 * 1024  # S3 multipart parts must be at least 5MB, except the last one
+
+# Created once per process; boto3 clients are thread safe so the upload threads can share it.
+s3 = boto3.client(
+    service_name='s3',
+    region_name='ap-south-1',
+    aws_access_key_id=AWS_ACCESS_KEY_ID,
+    aws_secret_access_key=AWS_SECRET_ACCESS_KEY
+)
+
+
+def key_exists(key):
+    try:
+        s3.head_object(Bucket=S3_BUCKET, Key=key)
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+            return False
+        raise
+    return True
+
+
+def available_key(file_name):
+    # One HEAD request per candidate name instead of listing the whole bucket. The key is reserved in the
+    # manifest, so concurrent uploads of the same name, and names of objects deleted from S3, move on.
+    key = file_name
+    dup = 1
+    while key_exists(key) or not reserve_key(key):
+        key = file_name.split('.csv')[0] + str(dup) + '.csv'
+        dup = dup + 1
+    return key
+
+
+class S3MultipartWriter:
+    def __init__(self, key):
+        self.key = key
+        self.upload_id = s3.create_multipart_upload(Bucket=S3_BUCKET, Key=key)['UploadId']
+        self.parts = []
+        self.sha256 = hashlib.sha256()  # content hash, built as the parts go out
+        self.size = 0
+
+    def upload_part(self, body):
+        part_number = len(self.parts) + 1
+        response = s3.upload_part(Bucket=S3_BUCKET, Key=self.key, UploadId=self.upload_id,
+                                  PartNumber=part_number, Body=body)
+        metrics.add('s3_bytes', len(body))
+        self.sha256.update(body)
+        self.size += len(body)
+        self.parts.append({'ETag': response['ETag'], 'PartNumber': part_number})
+
+    def complete(self):
+        s3.complete_multipart_upload(Bucket=S3_BUCKET, Key=self.key, UploadId=self.upload_id,
+                                     MultipartUpload={'Parts': self.parts})
+
+    def abort(self):
+        s3.abort_multipart_upload(Bucket=S3_BUCKET, Key=self.key, UploadId=self.upload_id)
+
+
+class FormFileStream:
+    # Incremental multipart/form-data parser: the bytes of the `file` field are collected in `buffer`
+    # as the request body arrives, so nothing is spooled to disk.
+    def __init__(self, content_type):
+        _, params = parse_options_header(content_type)
+        if b'boundary' not in params:
+            raise HTTPException(status_code=400, detail='Expected a multipart/form-data request')
+        self.filename = None
+        self.buffer = bytearray()
+        self._headers = {}
+        self._field = b''
+        self._value = b''
+        self._in_file = False
+        self.parser = MultipartParser(params[b'boundary'], {
+            'on_part_begin': self._on_part_begin,
+            'on_header_field': self._on_header_field,
+            'on_header_value': self._on_header_value,
+            'on_header_end': self._on_header_end,
+            'on_headers_finished': self._on_headers_finished,
+            'on_part_data': self._on_part_data,
+            'on_part_end': self._on_part_end,
+        })
+
+    def write(self, chunk):
+        self.parser.write(chunk)
+
+    def take(self, size):
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+    def _on_part_begin(self):
+        self._headers = {}
+
+    def _on_header_field(self, data, start, end):
+        self._field += data[start:end]
+
+    def _on_header_value(self, data, start, end):
+        self._value += data[start:end]
+
+    def _on_header_end(self):
+        self._headers[self._field.lower()] = self._value
+        self._field = b''
+        self._value = b''
+
+    def _on_headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b'content-disposition', b''))
+        if options.get(b'name') == b'file' and self.filename is None:
+            self._in_file = True
+            self.filename = options.get(b'filename', b'upload.csv').decode()
+
+    def _on_part_data(self, data, start, end):
+        if self._in_file:
+            self.buffer.extend(data[start:end])
+
+    def _on_part_end(self):
+        self._in_file = False
 
 
 
 # Begin API
 app = FastAPI()
 
-@app.post("/upload")
-async def upload(file: UploadFile = File(...)):
-    file_name = file.filename
-    print('file')
-    file_path = r'Uploads/' + file_name
-
-    # Save the uploaded file on server
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-        await file.close()
-
-
-    file_path = cwd+r'/'+file_path
-    file_path = file_path.replace('\\','/')
-    print(file_path)
-
-    #Save raw file in AWS S3 Bucket
-    s3 = boto3.resource(
-        service_name='s3',
-        region_name='ap-south-1',
-        aws_access_key_id=AWS_ACCESS_KEY_ID,
-        aws_secret_access_key=AWS_SECRET_ACCESS_KEY
-    )
-    file_name_exists = True
-    dup=1
-    while file_name_exists:
-        if file_name in [i.key for i in s3.Bucket('assamtenders').objects.all()]:
-            file_name = file_name.split('.csv')[0]+str(dup)+'.csv'
-            dup=dup+1
-        else:
-            file_name_exists = False
-
-    s3.Bucket('assamtenders').upload_file(Filename=file_path, Key=str(file_name))
+@app.post("/upload", openapi_extra={'requestBody': {'content': {'multipart/form-data': {'schema': {
+    'type': 'object', 'required': ['file'],
+    'properties': {'file': {'type': 'string', 'format': 'binary'}}}}}}})
+@instrumented
+async def upload(request: Request):
+    # Stream the request body straight into an S3 multipart upload, one part at a time.
+    # The blocking boto3 calls run in the threadpool so concurrent uploads don't stall the event loop.
+    form = FormFileStream(request.headers.get('content-type', ''))
+    file_name = None
+    writer = None
+    try:
+        async for chunk in request.stream():
+            form.write(chunk)
+            if writer is None and form.filename is not None:
+                file_name = await run_in_threadpool(available_key, form.filename)
+                writer = await run_in_threadpool(S3MultipartWriter, file_name)
+            while writer is not None and len(form.buffer) >= PART_SIZE:
+                await run_in_threadpool(writer.upload_part, form.take(PART_SIZE))
+
+        if writer is None:
+            raise HTTPException(status_code=400, detail='No file in request')
+        await run_in_threadpool(writer.upload_part, form.take(len(form.buffer)))
+
+        # Identical bytes were uploaded before: drop this copy instead of storing and processing it again
+        original_key = await run_in_threadpool(claim_upload, writer.key, writer.sha256.hexdigest(), writer.size)
+        if original_key is not None:
+            await run_in_threadpool(writer.abort)
+            await run_in_threadpool(release_upload, writer.key)
+            return {"File already uploaded to S3 as {}".format(original_key)}
+        await run_in_threadpool(writer.complete)
+    except Exception:
+        if writer is not None:
+            await run_in_threadpool(writer.abort)
+        if file_name is not None:
+            await run_in_threadpool(release_upload, file_name)
+        raise
+    await run_in_threadpool(advance, [writer.key], 'uploaded')
 
     # Response
     return {"File uploaded to S3"}
 
+@app.on_event("startup")
+def listen_for_refresh():
+    # my_etl sends a NOTIFY after refreshing flood_tenders_view; cached pages are dropped straight away
+    db.listen(read_models.REFRESH_CHANNEL, read_models.read_cache.clear)
+
+@app.on_event("startup")
+def load_classifier():
+    # Rivers are indexed once the listener connects and again whenever my_etl adds to assam_rivers. Until then
+    # the index is empty, so the API starts, and /classify answers without rivers, even with Postgres down.
+    db.listen(RIVERS_CHANNEL, tender_classifier.refresh)
+
+def flood_tenders_page(**filters):
+    try:
+        return read_models.flood_tenders(**filters)
+    except ValueError:
+        raise HTTPException(status_code=400, detail='Invalid cursor')
+
+@app.get("/rivers")
+def get_rivers():
+    return read_models.rivers()
+
+@app.get("/flood-tenders")
+def get_flood_tenders(river_id: Optional[int] = None, published_from: Optional[datetime.datetime] = None,
+                      published_to: Optional[datetime.datetime] = None, status: Optional[str] = None,
+                      after: Optional[str] = None,
+                      limit: int = Query(read_models.PAGE_SIZE, ge=1, le=read_models.MAX_PAGE_SIZE)):
+    # Newest first; pass the returned `next` as `after` for the following page
+    return flood_tenders_page(river_id=river_id, published_from=published_from, published_to=published_to,
+                              status=status, after=after, limit=limit)
+
+@app.get("/rivers/{river_id}/flood-tenders")
+def get_river_flood_tenders(river_id: int, published_from: Optional[datetime.datetime] = None,
+                            published_to: Optional[datetime.datetime] = None, status: Optional[str] = None,
+                            after: Optional[str] = None,
+                            limit: int = Query(read_models.PAGE_SIZE, ge=1, le=read_models.MAX_PAGE_SIZE)):
+    return flood_tenders_page(river_id=river_id, published_from=published_from, published_to=published_to,
+                              status=status, after=after, limit=limit)
+
+class Tender(BaseModel):
+    title: str
+    reference: Optional[str] = None
+
+@app.post("/classify")
+def classify(tenders: Union[Tender, List[Tender]]):
+    # Flood flag, matched keywords and best river for one tender, or for a list of them in the same order.
+    # Everything is in memory: no database round trip per request.
+    if isinstance(tenders, Tender):
+        return tender_classifier.classify(tenders.title, tenders.reference)
+    if len(tenders) > CLASSIFY_MAX_BATCH:
+        raise HTTPException(status_code=400, detail='At most {} tenders per request'.format(CLASSIFY_MAX_BATCH))
+    return [tender_classifier.classify(tender.title, tender.reference) for tender in tenders]
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    # Per-task timings and volumes recorded by the flow and the API, in Prometheus text format
+    return PlainTextResponse(metrics.render(), media_type='text/plain; version=0.0.4')
+
 if __name__ == '__main__':
     uvicorn.run(app)
\ No newline at end of file
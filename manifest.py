@@ -0,0 +1,74 @@
+from db import get_connection, SCHEMA_NAME
+
+
+# How far each uploaded object has got through my_etl, in order
+STAGES = ['uploading', 'uploaded', 'staged', 'loaded', 'classified']
+
+
+def create_manifest_table(cursor):
+    # One row per raw upload. content_sha256 is unique, so identical bytes are only stored and processed once;
+    # objects that reached S3 some other way are registered by the flow without a hash.
+    cursor.execute('''CREATE SCHEMA IF NOT EXISTS {}'''.format(SCHEMA_NAME))
+    cursor.execute('''CREATE TABLE IF NOT EXISTS upload_manifest (s3_key varchar PRIMARY KEY,
+                      content_sha256 varchar UNIQUE, size_bytes bigint, row_count bigint,
+                      stage varchar NOT NULL DEFAULT 'uploaded',
+                      created_at timestamptz NOT NULL DEFAULT now(),
+                      updated_at timestamptz NOT NULL DEFAULT now());''')
+
+
+def reserve_key(s3_key):
+    # Takes s3_key for an upload about to start. False if the manifest already has it -- another upload is
+    # using it, or the object was stored under it before, even if it has since gone from S3.
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        create_manifest_table(cursor)
+        cursor.execute('''INSERT INTO upload_manifest (s3_key, stage) VALUES (%s, 'uploading')
+                          ON CONFLICT (s3_key) DO NOTHING RETURNING s3_key;''', (s3_key,))
+        return cursor.fetchone() is not None
+
+
+def claim_upload(s3_key, content_sha256, size_bytes):
+    # Records the content of an upload to a reserved key before it is completed. Returns None if the content
+    # is new, or the key it was first stored under.
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        # Uploads of the same bytes check and claim the hash one at a time
+        cursor.execute('''SELECT pg_advisory_xact_lock(hashtext(%s));''', ('upload_manifest.' + content_sha256,))
+        cursor.execute('''SELECT s3_key FROM upload_manifest WHERE content_sha256 = %s;''', (content_sha256,))
+        row = cursor.fetchone()
+        if row is not None:
+            return row[0]
+        cursor.execute('''UPDATE upload_manifest SET content_sha256 = %s, size_bytes = %s, updated_at = now()
+                          WHERE s3_key = %s;''', (content_sha256, size_bytes, s3_key))
+        return None
+
+
+def release_upload(s3_key):
+    # The upload didn't complete -- free the key and forget the claim so the same file can be sent again
+    with get_connection() as conn:
+        conn.cursor().execute('''DELETE FROM upload_manifest WHERE s3_key = %s AND stage = 'uploading';''',
+                              (s3_key,))
+
+
+def pending_keys(s3_keys, before_stage):
+    # Registers keys the manifest hasn't seen and returns, in order, those that haven't reached before_stage
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        create_manifest_table(cursor)
+        cursor.execute('''INSERT INTO upload_manifest (s3_key) SELECT unnest(%s::varchar[])
+                          ON CONFLICT (s3_key) DO NOTHING;''', (list(s3_keys),))
+        cursor.execute('''SELECT s3_key, stage FROM upload_manifest WHERE s3_key = ANY(%s);''', (list(s3_keys),))
+        stages = dict(cursor.fetchall())
+    return [key for key in s3_keys if STAGES.index(stages[key]) < STAGES.index(before_stage)]
+
+
+def advance(s3_keys, stage, row_count=None):
+    # Moves keys forward to `stage`; a key that is already further along is left where it is
+    earlier = STAGES[:STAGES.index(stage)]
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        create_manifest_table(cursor)
+        cursor.execute('''UPDATE upload_manifest SET stage = %s, row_count = coalesce(%s, row_count),
+                          updated_at = now()
+                          WHERE s3_key = ANY(%s) AND stage = ANY(%s);''',
+                       (stage, row_count, list(s3_keys), earlier))
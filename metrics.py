@@ -0,0 +1,163 @@
+import time
+import sqlite3
+import asyncio
+import datetime
+import threading
+import functools
+import contextvars
+from contextlib import closing
+
+import pandas as pd
+import psutil
+from decouple import config
+
+
+# Local store shared by the Prefect agent and the API process
+METRICS_DB = config('METRICS_DB', default='metrics.sqlite')
+COUNTERS = ['rows_in', 'rows_out', 's3_bytes', 'db_round_trips', 'copy_rows', 'copy_bytes']
+
+_current = contextvars.ContextVar('metrics_counters', default=None)
+
+
+def add(counter, value=1):
+    # Add to a counter of the instrumented call running in this context; a no-op outside of one
+    counters = _current.get()
+    if counters is not None:
+        counters[counter] += value
+
+
+class PeakMemory:
+    # Samples the process RSS in a background thread while a stage runs
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.process = psutil.Process()
+        self.peak = 0
+        self._stop = threading.Event()
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self.process.memory_info().rss)
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = self.process.memory_info().rss
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.process.memory_info().rss)
+
+
+def count_rows(value):
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return len(value)
+    if isinstance(value, (tuple, list)):
+        return sum(count_rows(item) for item in value)
+    return 0
+
+
+def _connect():
+    conn = sqlite3.connect(METRICS_DB, timeout=10)
+    conn.execute('''CREATE TABLE IF NOT EXISTS task_runs (name text, started_at text, status text, seconds real,
+                    rows_in integer, rows_out integer, s3_bytes integer, db_round_trips integer,
+                    copy_rows integer, copy_bytes integer, peak_rss_bytes integer)''')
+    return conn
+
+
+def save(name, started_at, status, seconds, counters, peak_rss_bytes):
+    with closing(_connect()) as conn, conn:
+        conn.execute('INSERT INTO task_runs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                     [name, started_at, status, seconds] + [counters[c] for c in COUNTERS] + [peak_rss_bytes])
+
+
+class _Run:
+    def __init__(self, name, args):
+        self.name = name
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.counters['rows_in'] = count_rows(args)
+
+    def __enter__(self):
+        self.started_at = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        self.token = _current.set(self.counters)
+        self.memory = PeakMemory().__enter__()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop(exc_type)
+        self.finish()
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        # Joining the sampler and writing to SQLite block, so they run off the event loop
+        self.stop(exc_type)
+        await asyncio.get_running_loop().run_in_executor(None, self.finish)
+
+    def stop(self, exc_type):
+        self.seconds = time.perf_counter() - self.start
+        _current.reset(self.token)
+        self.status = 'success' if exc_type is None else 'failed'
+
+    def finish(self):
+        self.memory.__exit__(None, None, None)
+        save(self.name, self.started_at, self.status, self.seconds, self.counters, self.memory.peak)
+
+
+def instrumented(fn):
+    # Records wall time, rows in/out, S3 bytes, DB round trips, COPY volume and peak RSS of every call
+    if asyncio.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            async with _Run(fn.__name__, list(args) + list(kwargs.values())) as run:
+                result = await fn(*args, **kwargs)
+                run.counters['rows_out'] = count_rows(result)
+            return result
+    else:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with _Run(fn.__name__, list(args) + list(kwargs.values())) as run:
+                result = fn(*args, **kwargs)
+                run.counters['rows_out'] = count_rows(result)
+            return result
+    return wrapper
+
+
+def render():
+    # Prometheus text exposition of everything recorded so far
+    with closing(_connect()) as conn:
+        totals = conn.execute('''SELECT name, status, count(*), sum(seconds), {}
+                                 FROM task_runs GROUP BY name, status ORDER BY name, status'''.format(
+            ', '.join('sum({})'.format(c) for c in COUNTERS))).fetchall()
+        latest = conn.execute('''SELECT name, seconds, rows_in, peak_rss_bytes FROM task_runs
+                                 WHERE rowid IN (SELECT max(rowid) FROM task_runs GROUP BY name)
+                                 ORDER BY name''').fetchall()
+
+    lines = ['# HELP assam_task_runs_total Completed runs per task and status',
+             '# TYPE assam_task_runs_total counter']
+    lines += ['assam_task_runs_total{{task="{}",status="{}"}} {}'.format(name, status, runs)
+              for name, status, runs, *_ in totals]
+    lines += ['# HELP assam_task_seconds_total Wall time spent per task and status',
+              '# TYPE assam_task_seconds_total counter']
+    lines += ['assam_task_seconds_total{{task="{}",status="{}"}} {:.6f}'.format(name, status, seconds)
+              for name, status, runs, seconds, *_ in totals]
+    for i, counter in enumerate(COUNTERS):
+        lines += ['# HELP assam_task_{}_total Sum of {} per task and status'.format(counter, counter),
+                  '# TYPE assam_task_{}_total counter'.format(counter)]
+        lines += ['assam_task_{}_total{{task="{}",status="{}"}} {}'.format(counter, row[0], row[1], row[4 + i] or 0)
+                  for row in totals]
+    lines += ['# HELP assam_task_last_seconds Wall time of the latest run of each task',
+              '# TYPE assam_task_last_seconds gauge']
+    lines += ['assam_task_last_seconds{{task="{}"}} {:.6f}'.format(name, seconds) for name, seconds, *_ in latest]
+    lines += ['# HELP assam_task_last_rows_per_second Input rows per second in the latest run of each task',
+              '# TYPE assam_task_last_rows_per_second gauge']
+    lines += ['assam_task_last_rows_per_second{{task="{}"}} {:.1f}'.format(name, rows / seconds if seconds else 0)
+              for name, seconds, rows, peak in latest]
+    lines += ['# HELP assam_task_last_peak_rss_bytes Peak RSS during the latest run of each task',
+              '# TYPE assam_task_last_peak_rss_bytes gauge']
+    lines += ['assam_task_last_peak_rss_bytes{{task="{}"}} {}'.format(name, peak) for name, seconds, rows, peak in latest]
+    return '\n'.join(lines) + '\n'
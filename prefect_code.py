@@ -1,428 +1,682 @@
-from prefect import task, Flow, Parameter
-import os
+from prefect import task, Flow, Parameter, case
+from prefect.executors import LocalDaskExecutor
+from prefect.tasks.control_flow import merge
+from prefect.engine.signals import SKIP
+import contextvars
+from io import StringIO
+from concurrent.futures import ThreadPoolExecutor
 from decouple import config
 import boto3
+from botocore.exceptions import ClientError
 import pandas as pd
 import pandas.io.sql as psql
-import psycopg2
-from io import BytesIO
+from pandas.api.types import union_categoricals
 import numpy as np
-from fuzzywuzzy import fuzz
-
+import prefect
+import metrics
+import manifest
+from metrics import instrumented
+from db import get_connection, pool_stats
+from classifier import flood_classifier
+from rivers import standard_river_names
+from titles import normalise_titles, river_contexts
+from read_models import refresh_flood_view
+from rollups import refresh_rollups
+from schema_catalog import sync_table
+from river_registry import river_registry
+from sharding import ETL_WORKERS, run_sharded, classify_shard, match_rivers_shard
+from staging import parquet_key, is_parquet_key, to_parquet_bytes, read_parquet
+
+
+AWS_ACCESS_KEY_ID = config('AWS_ACCESS_KEY_ID', default=None)
+AWS_SECRET_ACCESS_KEY = config('AWS_SECRET_ACCESS_KEY', default=None)
+
+S3_BUCKET = 'assamtenders'
+S3_CONCURRENCY = config('S3_CONCURRENCY', default=4, cast=int)  # files downloaded and parsed at once
+PARQUET_STAGING = config('PARQUET_STAGING', default=True, cast=bool)  # batch loads read typed Parquet copies
+DATETIME_COLUMNS = ['date', 'tender_bidopening_date', 'tender_milestones', 'tender_milestones_duedate',
+                    'tender_datepublished']
+UPDATE_COLUMNS = ['tender_stage', 'tender_status']
+TYPED_LOAD = config('TYPED_LOAD', default=True, cast=bool)  # parse CSVs with LOAD_DTYPES
+# Typed load profile for the Assam OCDS export, by raw header: low-cardinality text is categorical and the
+# amount a nullable number. Dates are all ISO 8601 in UTC; an explicit format keeps pandas on its fast parser.
+LOAD_DTYPES = {'tender/stage': 'category',
+               'tender/status': 'category',
+               'tender/procurementMethod': 'category',
+               'tender/procuringEntity/name': 'category',
+               'buyer/name': 'category',
+               'tender/value/amount': 'Float64'}
+DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S%z'
+PSQL_TYPES = {'object': 'varchar',
+              'category': 'varchar',
+              'int64': 'int',
+              'Int64': 'int',
+              'float64': 'numeric',
+              'Float64': 'numeric',
+              'bool': 'boolean',
+              'boolean': 'boolean',
+              'datetime64[ns, UTC]': 'timestamp',
+              'datetime64[ns]': 'timestamp'}
+COLUMN_TYPES = {'tender_value_amount': 'numeric'}  # columns whose type doesn't follow the dtype
+# Advisory lock between loads (shared) and the read of identify_flood_tenders (exclusive), see upsert_static
+LOAD_SEQ_LOCK = 'tenders_static.load_seq'
+
+
+# Created once per process
+s3 = boto3.resource(
+    service_name='s3',
+    region_name='ap-south-1',
+    aws_access_key_id=AWS_ACCESS_KEY_ID,
+    aws_secret_access_key=AWS_SECRET_ACCESS_KEY
+)
+
+
+def s3_body(s3_key):
+    response = s3.Object(S3_BUCKET, s3_key).get()
+    metrics.add('s3_bytes', response['ContentLength'])
+    return response['Body']
+
+
+def read_s3_csv(s3_key, **kwargs):
+    if TYPED_LOAD:
+        kwargs.setdefault('dtype', LOAD_DTYPES)
+    return pd.read_csv(s3_body(s3_key), **kwargs)
+
+
+def s3_exists(s3_key):
+    try:
+        s3.Object(S3_BUCKET, s3_key).load()
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+            return False
+        raise
+    return True
+
+
+def s3_keys_under(s3_prefix):
+    # Raw uploads only; the Parquet copies next to them are derived
+    return sorted(obj.key for obj in s3.Bucket(S3_BUCKET).objects.filter(Prefix=s3_prefix)
+                  if not is_parquet_key(obj.key))
+
+
+def read_tenders(s3_key):
+    # A Parquet copy is already normalised and typed
+    if is_parquet_key(s3_key):
+        return read_parquet(s3_body(s3_key))
+    return normalise_tenders(read_s3_csv(s3_key))
+
+
+def stage_as_parquet(s3_key):
+    # Typed, compressed copy of a raw upload, written once and reused by every later run.
+    # Returns the key to read and, when the file was converted just now, the frame it was converted from
+    key = parquet_key(s3_key)
+    df = None
+    if not s3_exists(key):
+        df = normalise_tenders(read_s3_csv(s3_key))
+        s3.Object(S3_BUCKET, key).put(Body=to_parquet_bytes(df))
+    manifest.advance([s3_key], 'staged', row_count=None if df is None else len(df))
+    return key, df
+
+
+def normalise_column_name(column_name):
+    return column_name.lower().replace(" ", "_").replace(r'/', '_')
+
+
+def parse_datetimes(values):
+    # Timestamps with an offset (e.g. +05:30) are converted to UTC, which is what the timestamp columns hold.
+    # Already-parsed columns (Parquet copies, a second pass) are only converted if they are in another zone.
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values.dt.tz_convert('UTC') if values.dt.tz is not None else values
+    try:
+        return pd.to_datetime(values, format=DATETIME_FORMAT, utc=True, cache=True)
+    except ValueError:
+        return pd.to_datetime(values, utc=True, cache=True)  # not the usual format: let pandas work it out
+
+
+def apply_load_profile(df):
+    # LOAD_DTYPES for frames that weren't parsed with them, e.g. Parquet copies staged before the profile.
+    # Extension dtypes (categorical, Float64, Int64) mean the column is typed already.
+    for raw_name, dtype in LOAD_DTYPES.items():
+        column = normalise_column_name(raw_name)
+        if column in df and not pd.api.types.is_extension_array_dtype(df[column].dtype):
+            df[column] = df[column].astype(dtype)
+    # Whole amounts are stored as Int64, so COPY writes 4270334 and not 4270334.0
+    amounts = df.get('tender_value_amount')
+    if amounts is not None and amounts.dtype == 'Float64' and amounts.dropna().mod(1).eq(0).all():
+        df['tender_value_amount'] = amounts.astype('Int64')
+    return df
 
 
+def normalise_tenders(df):
+    # Clean column headers
+    df.columns = [normalise_column_name(column_name) for column_name in df.columns]
 
-DB_HOST = config('DB_HOST')
-DB_NAME = config('DB_NAME')
-DB_USER = config('DB_USER')
-DB_PASS = config('DB_PASS')
+    # Clean column types and map to POSTGRES types
+    for column in DATETIME_COLUMNS:
+        df[column] = parse_datetimes(df[column])
+    return apply_load_profile(df) if TYPED_LOAD else df
+
+
+def concat_tenders(frames):
+    # pd.concat turns categoricals whose categories differ into object columns: give them all the same ones first
+    for column in frames[0].columns if len(frames) > 1 else []:
+        if all(isinstance(df[column].dtype, pd.CategoricalDtype) for df in frames if column in df):
+            categories = union_categoricals([df[column] for df in frames if column in df]).categories
+            for df in frames:
+                if column in df:
+                    df[column] = df[column].cat.set_categories(categories)
+    return pd.concat(frames, ignore_index=True)
+
+
+def split_tenders(df):
+    # One static row per ocid (the first one seen); every distinct stage/status row goes to the update history.
+    # Rows and columns are picked in one .loc each, so each output is a single copy of its part of df.
+    update_columns = ['ocid', 'date'] + UPDATE_COLUMNS
+    df_static = df.loc[~df['ocid'].duplicated(), [column for column in df.columns if column not in UPDATE_COLUMNS]]
+    df_updates = df.loc[~df.duplicated(subset=update_columns), update_columns]
+    df_static.index = pd.RangeIndex(len(df_static))
+    df_updates.index = pd.RangeIndex(len(df_updates))
+    return df_static, df_updates
+
+
+def column_types(df):
+    # {column: Postgres type} of a frame; None for a column with no values, which says nothing about its type
+    empty = df.isna().all()
+    types = {}
+    for name, dtype in df.dtypes.astype(str).items():
+        if empty[name]:
+            types[name] = None
+        elif name in COLUMN_TYPES:
+            types[name] = COLUMN_TYPES[name]
+        elif dtype in PSQL_TYPES:
+            types[name] = PSQL_TYPES[dtype]
+        else:
+            raise ValueError('No Postgres type for column {} of dtype {}: add it to PSQL_TYPES or COLUMN_TYPES'
+                             .format(name, dtype))
+    return types
+
+
+def copy_to_table(cursor, df, table_name):
+    # COPY from an in-memory buffer, so concurrent flows don't share a data.csv on disk
+    data = StringIO()
+    df.to_csv(data, index=False, header=df.columns, encoding='utf-8')
+    metrics.add('copy_rows', len(df))
+    metrics.add('copy_bytes', data.tell())
+    data.seek(0)
+    insert = ''' COPY {}({}) FROM STDIN WITH
+                CSV
+                HEADER
+                DELIMITER AS ',';
+                '''.format(table_name, ', '.join(df.columns))
+    cursor.copy_expert(sql=insert, file=data)
 
 
-AWS_ACCESS_KEY_ID = config('AWS_ACCESS_KEY_ID')
-AWS_SECRET_ACCESS_KEY = config('AWS_SECRET_ACCESS_KEY')
+def upsert_static(cursor, df_static):
+    # COPY the batch into a staging table and let Postgres skip the ocids it already has,
+    # so the cost of a load depends on the incoming file and not on the size of tenders_static.
+    # load_seq values are drawn at insert time but become visible at commit, so a concurrent classification
+    # could see a later load's rows before an earlier one's and move its high-water mark past the earlier
+    # rows. Loads hold the lock shared until they commit; identify_flood_tenders takes it exclusively.
+    cursor.execute('''SELECT pg_advisory_xact_lock_shared(hashtext(%s));''', (LOAD_SEQ_LOCK,))
+    cursor.execute('''CREATE TEMP TABLE IF NOT EXISTS tenders_static_staging
+                      (LIKE tenders_static INCLUDING DEFAULTS) ON COMMIT DROP;''')
+    copy_to_table(cursor, df_static, 'tenders_static_staging')
+    columns = ', '.join(df_static.columns)
+    cursor.execute('''INSERT INTO tenders_static({0}) SELECT {0} FROM tenders_static_staging
+                      ON CONFLICT (ocid) DO NOTHING RETURNING ocid;'''.format(columns))
+    new_ocids = [row[0] for row in cursor.fetchall()]
 
-@task
-def extract_from_s3(s3_key):
-    #Extract raw file in AWS S3 Bucket
-    s3 = boto3.resource(
-        service_name='s3',
-        region_name='ap-south-1',
-        aws_access_key_id=AWS_ACCESS_KEY_ID,
-        aws_secret_access_key=AWS_SECRET_ACCESS_KEY
-    )
-
-    obj = s3.Object('assamtenders', s3_key)
-    with BytesIO(obj.get()['Body'].read()) as bio:
-        df = pd.read_csv(bio)
+    # Title words for the rows that were actually inserted
+    new_rows = df_static[df_static['ocid'].isin(new_ocids)]
+    copy_to_table(cursor, normalise_titles(new_rows['ocid'], new_rows['tender_title']), 'tender_titles')
 
-    return df
 
-@task(nout=4)
-def transform_into_schema(df):
-    # Schema Design:
-    # 1NF Remove Duplicates and multivalued columns (if any)
-    df = df.drop_duplicates(subset='ocid').reset_index(drop=True)
-    # 2NF and 3NF are satisfied -- there are no partial, transitive dependencies.
+def create_static_table(conn, cols_table_1):
+    cursor = conn.cursor()
+    # CREATE or migrate TABLE1 on DB -- TRANSACTION 2
+    # Only when the incoming columns differ from the schema catalog; a steady-state load runs no DDL.
+    # load_seq numbers rows in load order, so later stages can pick up only the rows added since their last run
+    sync_table(cursor, 'tenders_static', cols_table_1,
+               '''CREATE TABLE tenders_static ({}, PRIMARY KEY (ocid));''', managed={'load_seq': 'bigserial'})
+
+    # Normalised title words, computed once at load time and read by every stage that parses titles
+    cursor.execute("SELECT to_regclass('tender_titles') IS NULL;")
+    if cursor.fetchone()[0]:
+        cursor.execute('''CREATE TABLE tender_titles (ocid varchar PRIMARY KEY, title_words varchar,
+                          river_position int, river_prefix varchar, river_suffix varchar,
+                          FOREIGN KEY (ocid) REFERENCES tenders_static(ocid));''')
+        existing = psql.read_sql('''SELECT ocid, tender_title FROM tenders_static;''', conn)
+        copy_to_table(cursor, normalise_titles(existing['ocid'], existing['tender_title']), 'tender_titles')
+    conn.commit()
 
-    # Clean column headers
-    df.columns = [column_name.lower().replace(" ", "_").replace(r'/', '_') for column_name in df.columns]
 
-    # Clean column types and map to POSTGRES types
-    df.date = pd.to_datetime(df.date)
-    df.tender_bidopening_date = pd.to_datetime(df.tender_bidopening_date)
-    df.tender_milestones = pd.to_datetime(df.tender_milestones)
-    df.tender_milestones_duedate = pd.to_datetime(df.tender_milestones_duedate)
-    df.tender_datepublished = pd.to_datetime(df.tender_datepublished)
-
-    psql_types = {'object': 'varchar',
-                  'int64': 'int',
-                  'datetime64[ns, UTC]': 'timestamp',
-                  'datetime64[ns]': 'timestamp'}
-
-    df_static = df.drop(['tender_stage', 'tender_status'], axis=1)
-    cols_table_1 = ', '.join(
-        "{} {}".format(n, d) for (n, d) in zip(df_static.columns, df_static.dtypes.astype(str).replace(psql_types)))
-
-    df_updates = df[['ocid', 'date', 'tender_stage', 'tender_status']]
-    cols_table_2 = ', '.join(
-        "{} {}".format(n, d) for (n, d) in zip(df_updates.columns, df_updates.dtypes.astype(str).replace(psql_types)))
-    return df_static, cols_table_1, df_updates, cols_table_2
+def create_update_partitions(cursor, source_table):
+    # A tenders_update partition for every month with rows in source_table that doesn't have one yet
+    cursor.execute('''SELECT child.relname FROM pg_inherits
+                      INNER JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+                      WHERE pg_inherits.inhparent = 'tenders_update'::regclass;''')
+    existing = {row[0] for row in cursor.fetchall()}
+    cursor.execute('''SELECT DISTINCT date_trunc('month', date) FROM {} WHERE date IS NOT NULL;'''.format(source_table))
+    for (month,) in cursor.fetchall():
+        name = 'tenders_update_{:%Y_%m}'.format(month)
+        if name not in existing:
+            next_month = (month.replace(day=1) + pd.Timedelta(days=32)).replace(day=1)
+            cursor.execute('''CREATE TABLE IF NOT EXISTS {} PARTITION OF tenders_update
+                              FOR VALUES FROM (%s) TO (%s);'''.format(name), (month, next_month))
 
-@task
-def load_to_db_static(df_static,cols_table_1):
-    schema_name = 'assam_procurements'
-    table1_name = 'tenders_static'  # For fields that would be written only once.
 
-    #Connect to db
-    conn = psycopg2.connect(dbname=DB_NAME, user=DB_USER, password=DB_PASS, host=DB_HOST, port=5432)
+def create_updates_table(conn, cols_table_2):
     cursor = conn.cursor()
-
-    # Create Schema in DB -- TRANSACTION 1
-    create_schema = '''CREATE SCHEMA IF NOT EXISTS {}'''.format(schema_name)
-    cursor.execute(create_schema)
+    # Tables from before partitioning are moved into the partitioned table once
+    cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('tenders_update');")
+    relkind = cursor.fetchone()
+    unpartitioned = relkind is not None and relkind[0] != 'p'
+    if unpartitioned:
+        cursor.execute('''ALTER TABLE tenders_update RENAME TO tenders_update_unpartitioned;''')
+        cursor.execute('''DROP INDEX IF EXISTS tenders_update_ocid_date;''')
+
+    # CREATE or migrate TABLE2 on DB -- TRANSACTION 4
+    # Partitioned by month on date: loads and date-bounded queries only touch the months involved, and an
+    # old month can be detached with ALTER TABLE tenders_update DETACH PARTITION tenders_update_YYYY_MM.
+    # Rows without a date go to the default partition.
+    create_table = '''CREATE TABLE tenders_update ({},
+                        FOREIGN KEY (ocid) REFERENCES tenders_static(ocid)) PARTITION BY RANGE (date);'''
+    if sync_table(cursor, 'tenders_update', cols_table_2, create_table) is not None:
+        cursor.execute('''CREATE TABLE IF NOT EXISTS tenders_update_default PARTITION OF tenders_update DEFAULT;''')
+        cursor.execute('''CREATE INDEX IF NOT EXISTS tenders_update_ocid_date ON tenders_update (ocid, date);''')
+
+    if unpartitioned:
+        create_update_partitions(cursor, 'tenders_update_unpartitioned')
+        cursor.execute('''INSERT INTO tenders_update SELECT * FROM tenders_update_unpartitioned;''')
+        cursor.execute('''DROP TABLE tenders_update_unpartitioned;''')
+
+    # Current stage/status per ocid, kept up to date by upsert_updates
+    cursor.execute("SELECT to_regclass('tenders_latest_status') IS NULL;")
+    if cursor.fetchone()[0]:
+        # Drop the repeats earlier loads appended: rows whose state is the same as the ocid's previous row
+        # (ctid is only unique within a partition, hence tableoid)
+        cursor.execute('''DELETE FROM tenders_update WHERE (tableoid, ctid) IN (
+                              SELECT tableoid, ctid FROM (SELECT tableoid, ctid, ARRAY[tender_stage, tender_status] AS state,
+                                                                 lag(ARRAY[tender_stage, tender_status])
+                                                                 OVER (PARTITION BY ocid ORDER BY date, ctid) AS previous
+                                                          FROM tenders_update) history
+                              WHERE state IS NOT DISTINCT FROM previous);''')
+        cursor.execute('''CREATE TABLE tenders_latest_status (ocid varchar PRIMARY KEY, date timestamp,
+                          tender_stage varchar, tender_status varchar,
+                          FOREIGN KEY (ocid) REFERENCES tenders_static(ocid));''')
+        cursor.execute('''INSERT INTO tenders_latest_status
+                          SELECT DISTINCT ON (ocid) ocid, date, tender_stage, tender_status FROM tenders_update
+                          ORDER BY ocid, date DESC;''')
     conn.commit()
 
 
-    # CREATE TABLE1 on DB -- TRANSACTION 2
-    cursor.execute("SET search_path TO {}".format(schema_name))
-    create_table = '''CREATE TABLE IF NOT EXISTS {} ({}, PRIMARY KEY (ocid));'''.format(table1_name, cols_table_1)
-    cursor.execute(create_table)
-    cursor.execute('''ALTER TABLE {} ALTER COLUMN tender_value_amount TYPE numeric'''.format(table1_name))
-    conn.commit()
+def upsert_updates(cursor, df_updates):
+    # Change capture: a row is stored only when it moves an ocid to a different stage/status than the row just
+    # before it by date, whether that one is stored or incoming. Incoming rows are placed in the ocid's stored
+    # history rather than after it, so older rows (a shuffled chunk, a backfilled month) are kept too, and a
+    # stored row that an inserted one turns into a repeat is deleted. The history is then the same whatever
+    # order and batches the rows were loaded in.
+    cursor.execute('''CREATE TEMP TABLE IF NOT EXISTS tenders_update_staging
+                      (LIKE tenders_update INCLUDING DEFAULTS) ON COMMIT DROP;''')
+    copy_to_table(cursor, df_updates, 'tenders_update_staging')
+    create_update_partitions(cursor, 'tenders_update_staging')
+    cursor.execute('''WITH incoming AS (
+                          SELECT ocid, date, tender_stage, tender_status FROM tenders_update_staging
+                          EXCEPT
+                          SELECT ocid, date, tender_stage, tender_status FROM tenders_update
+                          WHERE ocid IN (SELECT ocid FROM tenders_update_staging)),
+                      history AS (
+                          SELECT *, CASE WHEN ctid IS NULL THEN previous IS DISTINCT FROM state
+                                         ELSE previous_stored OR previous IS DISTINCT FROM state END AS kept
+                          FROM (SELECT rows.*, ARRAY[tender_stage, tender_status] AS state,
+                                       lag(ARRAY[tender_stage, tender_status]) OVER w AS previous,
+                                       lag(ctid IS NOT NULL) OVER w AS previous_stored
+                                FROM (SELECT ocid, date, tender_stage, tender_status, tableoid, ctid
+                                      FROM tenders_update WHERE ocid IN (SELECT ocid FROM incoming)
+                                      UNION ALL
+                                      SELECT ocid, date, tender_stage, tender_status, NULL::oid, NULL::tid
+                                      FROM incoming) rows
+                                WINDOW w AS (PARTITION BY ocid ORDER BY date, tender_stage, tender_status)) ordered),
+                      inserted AS (
+                          INSERT INTO tenders_update (ocid, date, tender_stage, tender_status)
+                          SELECT ocid, date, tender_stage, tender_status FROM history WHERE ctid IS NULL AND kept),
+                      repeats AS (
+                          DELETE FROM tenders_update WHERE (tableoid, ctid) IN (
+                              SELECT tableoid, ctid FROM history WHERE ctid IS NOT NULL AND NOT kept))
+                      INSERT INTO tenders_latest_status
+                      SELECT DISTINCT ON (ocid) ocid, date, tender_stage, tender_status FROM history WHERE kept
+                      ORDER BY ocid, date DESC, tender_stage DESC, tender_status DESC
+                      ON CONFLICT (ocid) DO UPDATE SET date = EXCLUDED.date, tender_stage = EXCLUDED.tender_stage,
+                                                       tender_status = EXCLUDED.tender_status
+                      WHERE (tenders_latest_status.date, tenders_latest_status.tender_stage,
+                             tenders_latest_status.tender_status)
+                            IS DISTINCT FROM (EXCLUDED.date, EXCLUDED.tender_stage, EXCLUDED.tender_status);''')
 
-    # insert values to table1 -- TRANSACTION 3
-    cursor.execute("SET search_path TO {}".format(schema_name))
-    dataframe = psql.read_sql('''SELECT ocid FROM {};'''.format(table1_name), conn)
-    merged = df_static.merge(dataframe, on='ocid', how='left', indicator=True)
-    merged = merged[merged["_merge"] == 'left_only'].drop('_merge', axis=1)
-    merged.to_csv('data.csv', index=False, header=merged.columns, encoding='utf-8')
-    data = open('data.csv')
-    insert = ''' COPY {} FROM STDIN WITH
-                CSV
-                HEADER
-                DELIMITER AS ',';
-                '''.format(table1_name)
-    cursor.copy_expert(sql=insert, file=data)
-    conn.commit()
-    data.close()
-    # Finally remove files from server
-    os.remove('data.csv')
 
-    return None
+@task
+@instrumented
+def list_s3_keys(s3_key, s3_keys, s3_prefix):
+    # Every file for this run: a single key, a list of keys and/or everything under a prefix, in key order
+    keys = ([s3_key] if s3_key else []) + list(s3_keys or [])
+    if s3_prefix:
+        keys += s3_keys_under(s3_prefix)
+    keys = list(dict.fromkeys(keys))
+    if not keys:
+        raise ValueError('No S3 objects to load: pass s3_key, s3_keys or an s3_prefix with objects under it')
+    return keys
 
 @task
-def load_to_db_updates(df_updates, cols_table_2):
-    conn = psycopg2.connect(dbname=DB_NAME, user=DB_USER, password=DB_PASS, host=DB_HOST, port=5432)
-    cursor = conn.cursor()
-    schema_name = 'assam_procurements'
-    table1_name = 'tenders_static'  # For fields that would be written only once.
-    table2_name = 'tenders_update'  # For fields that would see constant updates. (tender_status etc)
-
-    # CREATE TABLE2 on DB -- TRANSACTION 4
-    cursor.execute("SET search_path TO {}".format(schema_name))
-    create_table = '''CREATE TABLE IF NOT EXISTS {} ({}, FOREIGN KEY (ocid) REFERENCES {}(ocid));'''.format(table2_name,
-                                                                                                            cols_table_2,
-                                                                                                            table1_name)
-    cursor.execute(create_table)
-    conn.commit()
+@instrumented
+def pending_files(s3_keys, reprocess):
+    # Files an earlier run already loaded are left out, so a run that failed part way resumes after
+    # its last completed stage instead of reading and loading everything again
+    if reprocess:
+        return s3_keys
+    return manifest.pending_keys(s3_keys, 'loaded')
 
-    # insert values to table2 -- TRANSACTION 5
-    cursor.execute("SET search_path TO {}".format(schema_name))
-    dataframe = psql.read_sql('''SELECT ocid, date FROM {};'''.format(table2_name), conn)
-    dataframe['date'] = pd.to_datetime(dataframe['date'], utc=True)
-    merged = df_updates.merge(dataframe.head(), how='left', on=['ocid', 'date'], indicator=True)
-    merged = merged[merged['_merge'] == 'left_only'].drop('_merge', axis=1)
-    merged.to_csv('data.csv', index=False, header=df_updates.columns, encoding='utf-8')
+@task
+@instrumented
+def record_stage(s3_keys, stage):
+    manifest.advance(s3_keys, stage)
 
-    data = open('data.csv')
+@task
+@instrumented
+def stage_parquet(s3_keys):
+    # Converts raw CSV uploads that have no Parquet copy yet. Returns (key, frame) for each file the batch load
+    # reads; the frame is the one parsed for the conversion, or None when the file has to be read from the key
+    if not PARQUET_STAGING:
+        return [(key, None) for key in s3_keys]
+    with ThreadPoolExecutor(S3_CONCURRENCY) as pool:
+        futures = [pool.submit(contextvars.copy_context().run, stage_as_parquet, key) for key in s3_keys]
+        return [future.result() for future in futures]
 
-    insert = ''' COPY {} FROM STDIN WITH
-                CSV
-                HEADER
-                DELIMITER AS ',';
-                '''.format(table2_name)
+@task
+@instrumented
+def extract_from_s3(staged):
+    # Parse straight from the S3 bodies instead of buffering whole objects in memory first. Files are read
+    # S3_CONCURRENCY at a time and concatenated in key order, so the first file to mention an ocid wins.
+    # Files stage_parquet has just parsed are used as they are rather than downloaded again.
+    if not staged:
+        raise SKIP('Every file has been loaded already')
+    with ThreadPoolExecutor(S3_CONCURRENCY) as pool:
+        futures = {i: pool.submit(contextvars.copy_context().run, read_tenders, key)
+                   for i, (key, frame) in enumerate(staged) if frame is None}
+        df = concat_tenders([futures[i].result() if i in futures else frame
+                             for i, (_, frame) in enumerate(staged)])
 
-    cursor.copy_expert(sql=insert, file=data)
-    conn.commit()
-    data.close()
-    conn.close()
-    #Finally remove files from server
-    os.remove('data.csv')
+    return df
 
-    # Response
-    return None
+@task(nout=4)
+@instrumented
+def transform_into_schema(df):
+    # Schema Design:
+    # 1NF Remove Duplicates and multivalued columns (if any) -- split_tenders keeps one static row per ocid
+    # 2NF and 3NF are satisfied -- there are no partial, transitive dependencies.
+    df = normalise_tenders(df)
 
-@task
-def identify_flood_tenders():
-    conn = psycopg2.connect(dbname=DB_NAME, user=DB_USER, password=DB_PASS, host=DB_HOST, port=5432)
-    cursor = conn.cursor()
-    cursor.execute("SET search_path TO assam_procurements")
-    cursor.execute("DROP TABLE IF EXISTS tenders_flood;")
-    conn.commit()
+    df_static, df_updates = split_tenders(df)
+    cols_table_1 = column_types(df_static)
+    cols_table_2 = column_types(df_updates)
+    return df_static, cols_table_1, df_updates, cols_table_2
 
-    # Keywords to identify flood related tenders
-    positive_kw = ['Flood', 'Embankment', 'embkt', 'Relief', 'Erosion', 'SDRF', 'River', 'Inundation', 'Hydrology',
-                   'Silt', 'Siltation', 'Bund', 'Trench', 'Drain', 'Culvert', 'Sluice', 'Bridge', 'Dyke',
-                   'Storm water drain']
-    negative_kw = ['Driver', 'Floodlight', 'Flood Light']
-    positive_kw = [kw.lower() for kw in positive_kw]
-    negative_kw = [kw.lower() for kw in negative_kw]
+@task
+@instrumented
+def load_to_db_static(df_static,cols_table_1):
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        create_static_table(conn, cols_table_1)
 
-    # Read table created in the above task
-    df = psql.read_sql('''SELECT ocid, tender_title, tender_externalreference FROM tenders_static;''', conn)
-    # Logic for filtering flood related tenders based on title and reference
-    df['flood_related_bool1'] = df['tender_title'].map(
-        lambda x: max([word.lower() in positive_kw for word in x.split()]))
-    df['flood_related_bool2'] = df['tender_externalreference'].map(
-        lambda x: max([word.lower() in positive_kw for word in x.split()]))
+        # insert new values to table1 -- TRANSACTION 3
+        upsert_static(cursor, df_static)
 
-    df['not_flood_related_bool1'] = df['tender_title'].map(
-        lambda x: max([word.lower() in negative_kw for word in x.split()]))
-    df['not_flood_related_bool2'] = df['tender_externalreference'].map(
-        lambda x: max([word.lower() in negative_kw for word in x.split()]))
+    return None
 
-    df['flood_related_bool'] = (df['flood_related_bool1']) | (df['flood_related_bool2'])
-    df.drop(['flood_related_bool1', 'flood_related_bool2'], axis=1, inplace=True)
+@task
+@instrumented
+def load_to_db_updates(df_updates, cols_table_2):
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        create_updates_table(conn, cols_table_2)
 
-    df['not_flood_related_bool'] = (df['not_flood_related_bool1']) | (df['not_flood_related_bool2'])
-    df.drop(['not_flood_related_bool1', 'not_flood_related_bool2'], axis=1, inplace=True)
+        # insert changed states to table2 -- TRANSACTION 5
+        upsert_updates(cursor, df_updates)
 
-    flood_df = df[(df['flood_related_bool']) & (~df['not_flood_related_bool'])]
-    flood_df = flood_df[['ocid']]
+    # Response
+    return None
 
-    return flood_df
+@task
+@instrumented
+def use_streaming(chunksize):
+    return chunksize is not None
 
 @task
-def create_tender_flood_table(flood_df):
-    conn = psycopg2.connect(dbname=DB_NAME, user=DB_USER, password=DB_PASS, host=DB_HOST, port=5432)
-    cursor = conn.cursor()
-    cursor.execute("SET search_path TO assam_procurements")
-    cursor.execute("DROP TABLE IF EXISTS tenders_flood;")
-    conn.commit()
+@instrumented
+def stream_s3_to_db(s3_keys, chunksize):
+    # Streaming mode: parse the S3 bodies `chunksize` rows at a time and load each chunk before reading the next,
+    # so peak memory depends on the chunk size rather than on the size of the files.
+    chunks = (chunk for key in s3_keys for chunk in read_s3_csv(key, chunksize=int(chunksize)))
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        for chunk in chunks:
+            metrics.add('rows_in', len(chunk))
+            df_static, df_updates = split_tenders(normalise_tenders(chunk))
+
+            # Every chunk is checked against the schema catalog, so a later file with a new column or a wider
+            # type is migrated before it is loaded; chunks that match it only read the catalog
+            create_static_table(conn, column_types(df_static))
+            create_updates_table(conn, column_types(df_updates))
+
+            # Each chunk commits before the next, so upsert_static keeps the first static row per ocid across chunks
+            # and files, and upsert_updates places each chunk's rows in the history the earlier ones left
+            upsert_static(cursor, df_static)
+            upsert_updates(cursor, df_updates)
+            conn.commit()
 
-    ## CREATE FLOOD TENDERS TABLE -- TRANSACTION 1
-    create_table = '''CREATE TABLE IF NOT EXISTS tenders_flood (id SERIAL PRIMARY KEY,ocid varchar,
-                          FOREIGN KEY (ocid) REFERENCES tenders_static(ocid));'''
-    cursor.execute(create_table)
-    conn.commit()
+    return None
 
-    # insert new values to tender_floods table -- TRANSACTION 2
-    flood_df.to_csv('data.csv', index=False, header=flood_df.columns, encoding='utf-8')
-    data = open('data.csv')
+def flood_state(cursor):
+    # Keyword version and highest load_seq that tenders_flood has been classified up to
+    cursor.execute('''CREATE TABLE IF NOT EXISTS tenders_flood_state (keywords_version varchar, high_water_mark bigint);''')
+    cursor.execute('''SELECT keywords_version, high_water_mark FROM tenders_flood_state;''')
+    return cursor.fetchone() or (None, 0)
 
-    insert = ''' COPY tenders_flood(ocid) FROM STDIN WITH
-                        CSV
-                        HEADER
-                        DELIMITER AS ',';
-                        '''
-    cursor.copy_expert(sql=insert, file=data)
-    conn.commit()
-    data.close()
+# Runs even when the loads were skipped, so a run that failed after loading still classifies
+@task(nout=3, skip_on_upstream_skip=False)
+@instrumented
+def identify_flood_tenders():
+    with get_connection() as conn:
+        previous_state = flood_state(conn.cursor())
+        keywords_version, high_water_mark = previous_state
+        if keywords_version != flood_classifier.version:
+            # Keywords, classified fields or title normalisation changed (or first run) -- reclassify the whole table
+            high_water_mark = 0
+
+        # Only tenders loaded since the last successful classification. Waiting for the loads in flight to
+        # commit means every load_seq up to the highest one read here is committed and read. The lock ends with
+        # this transaction: runs that overlap are caught when create_tender_flood_table moves the state.
+        conn.cursor().execute('''SELECT pg_advisory_xact_lock(hashtext(%s));''', (LOAD_SEQ_LOCK,))
+        df = psql.read_sql('''SELECT ocid, {}, load_seq FROM tenders_static
+                              INNER JOIN tender_titles USING (ocid)
+                              WHERE load_seq > %(high_water_mark)s;'''.format(', '.join(flood_classifier.fields)), conn,
+                           params={'high_water_mark': int(high_water_mark)})
+    metrics.add('rows_in', len(df))
+    if not df.empty:
+        high_water_mark = int(df['load_seq'].max())
+
+    # Logic for filtering flood related tenders based on title and reference, sharded by ocid range
+    flood_related = run_sharded(classify_shard, df)
+    flood_df = df.loc[flood_related, ['ocid']]
+
+    return flood_df, high_water_mark, previous_state
 
-    # Remove files on server
-    os.remove('data.csv')
-    conn.close()
+@task
+@instrumented
+def create_tender_flood_table(flood_df, high_water_mark, previous_state):
+    # previous_state is the (keywords_version, high_water_mark) identify_flood_tenders started from
+    previous_version, previous_high_water_mark = previous_state
+    with get_connection() as conn:
+        cursor = conn.cursor()
+
+        ## CREATE FLOOD TENDERS TABLE -- TRANSACTION 1
+        create_table = '''CREATE TABLE IF NOT EXISTS tenders_flood (id SERIAL PRIMARY KEY,ocid varchar UNIQUE,
+                              FOREIGN KEY (ocid) REFERENCES tenders_static(ocid));'''
+        cursor.execute(create_table)
+        # Tables from before ocid was unique: drop the copies overlapping runs appended, keeping the first
+        cursor.execute("SELECT to_regclass('tenders_flood_ocid_key') IS NULL;")
+        if cursor.fetchone()[0]:
+            cursor.execute('''DELETE FROM tenders_flood duplicate USING tenders_flood first
+                              WHERE duplicate.ocid = first.ocid AND duplicate.id > first.id;''')
+            cursor.execute('''ALTER TABLE tenders_flood ADD CONSTRAINT tenders_flood_ocid_key UNIQUE (ocid);''')
+        if previous_version != flood_classifier.version:
+            cursor.execute("TRUNCATE tenders_flood;")
+
+        # append new values to tender_floods table -- TRANSACTION 2
+        cursor.execute('''CREATE TEMP TABLE IF NOT EXISTS tenders_flood_staging (ocid varchar) ON COMMIT DROP;''')
+        copy_to_table(cursor, flood_df, 'tenders_flood_staging')
+        cursor.execute('''INSERT INTO tenders_flood (ocid) SELECT ocid FROM tenders_flood_staging
+                          ON CONFLICT (ocid) DO NOTHING;''')
+
+        # The high-water mark moves in the same transaction, so a failed run resumes from where it stopped.
+        # It only moves from the state this run started from: a run that overlapped another and started from a
+        # mark that has since moved fails, and its rows are rolled back.
+        if previous_version is None:
+            cursor.execute('''INSERT INTO tenders_flood_state SELECT %s, %s
+                              WHERE NOT EXISTS (SELECT FROM tenders_flood_state);''',
+                           (flood_classifier.version, high_water_mark))
+        else:
+            cursor.execute('''UPDATE tenders_flood_state SET keywords_version = %s, high_water_mark = %s
+                              WHERE keywords_version = %s AND high_water_mark = %s;''',
+                           (flood_classifier.version, high_water_mark, previous_version, previous_high_water_mark))
+        if cursor.rowcount != 1:
+            raise RuntimeError('tenders_flood_state moved on from ({}, {}) while this run was classifying'
+                               .format(previous_version, previous_high_water_mark))
     return None
 
 @task
+@instrumented
 def standardise_river_names():
-    conn = psycopg2.connect(dbname=DB_NAME, user=DB_USER, password=DB_PASS, host=DB_HOST, port=5432)
-    cursor = conn.cursor()
-    cursor.execute("SET search_path TO assam_procurements")
-
-    flood_df = psql.read_sql('''SELECT tenders_flood.ocid, tender_title FROM tenders_static
-                                INNER JOIN tenders_flood
-                                ON tenders_static.ocid=tenders_flood.ocid;''', conn)
-    river_df = flood_df[
-        (flood_df['tender_title'].str.contains('River')) | (flood_df['tender_title'].str.contains('river'))]
-    rivers = []
-    for title in river_df['tender_title']:
-        title = title.replace(',', ' ').replace('_', ' '). \
-            replace('.', ' ').replace('ofriver', 'river'). \
-            replace('Riverbank', 'river').replace('-', ' ').replace('RIVER', 'river').replace('River', 'river')
-
-        if 'river' in title:
-            idx = title.split().index('river')
-            prefix = title.split()[idx - 1]
-
-            try:
-                suffix = title.split()[idx + 1]
-            except:
-                suffix = 'River'  # This is manually removed later
-
-            if prefix in ['samoka']:
-                river = prefix
-            elif suffix in ['brahmaputra', 'kollong']:
-                river = suffix
-            # These were the only rivers with lower case initials.
-            elif (suffix[0].isupper()) & (len(suffix) >= 4):
-                river = suffix
-            elif (prefix[0].isupper()) & (len(prefix) >= 4):
-                river = prefix
-            else:
-                river = None
-
-        rivers.append(river)
-
-    r1 = list(set(rivers).copy() - set([None]))
-    r1.sort(reverse=True)
-    r2 = list(set(rivers).copy() - set([None]))
-    r2.sort()
-
-    def remove_spelling_mistakes(r1, r2):
-        for i in r1:
-            scores = []
-            for j in r2:
-                scores.append(fuzz.ratio(i, j))
-            while max(scores) == 100:
-                scores[scores.index(100)] = -1
-
-            if max(scores) >= 80:
-                change = r2[scores.index(max(scores))]
-                to_delete = r1[r1.index(i)]
-                r1[r1.index(i)] = change
-                r2[r2.index(to_delete)] = change
-        return r1, r2
-
-    k = True
-    elbow = []
-    while k:
-        r1, r2 = remove_spelling_mistakes(r1, r2)
-        elbow.append(len(set(r2)))
-        if (len(elbow) >= 2):
-            if (elbow[-1] == elbow[-2]):
-                k = False
-    # Elbow reached in two iterations.
-
-    # Manually removing remaining bad elements
-    river_names_std = set(r1) - set(['Bank', 'Training', 'Erosion', 'Front', 'Course', 'District', 'River', 'Embankment'])
+    with get_connection() as conn:
+        river_df = psql.read_sql('''SELECT river_prefix, river_suffix FROM tender_titles
+                                    INNER JOIN tenders_flood
+                                    ON tender_titles.ocid=tenders_flood.ocid
+                                    WHERE river_position IS NOT NULL;''', conn)
+
+    metrics.add('rows_in', len(river_df))
+
+    # Spelling variants are merged in a single clustering pass; generic words are removed afterwards
+    river_names_std = standard_river_names(river_contexts(river_df))
     return river_names_std
 
 @task
+@instrumented
 def create_assam_rivers_table(river_names_std):
-    conn = psycopg2.connect(dbname=DB_NAME, user=DB_USER, password=DB_PASS, host=DB_HOST, port=5432)
-    cursor = conn.cursor()
-    cursor.execute("SET search_path TO assam_procurements")
-
-    river_df = psql.read_sql('''SELECT river_name FROM assam_rivers''', conn)
-    river_names = river_df.river_name.to_list()
-
-    river_names_std = list(set(river_names_std)-set(river_names))
-
-
-    # CREATE TABLE for rivers
-    cursor.execute(
-        "CREATE TABLE IF NOT EXISTS assam_procurements.assam_rivers (id serial PRIMARY KEY, river_name varchar);")
-    for river in list(river_names_std):
-        cursor.execute("INSERT INTO assam_procurements.assam_rivers(river_name) VALUES ('{}');".format(str(river)))
-    conn.commit()
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        river_registry.create_table(cursor)
+        river_registry.register(cursor, river_names_std)
 
 @task
+@instrumented
 def identify_river_from_title():
-    conn = psycopg2.connect(dbname=DB_NAME, user=DB_USER, password=DB_PASS, host=DB_HOST, port=5432)
-    cursor = conn.cursor()
-    cursor.execute("SET search_path TO assam_procurements")
-    cursor.execute("DROP TABLE IF EXISTS tender_river;")
-    conn.commit()
+    with get_connection() as conn:
+        flood_df = psql.read_sql('''SELECT tenders_flood.ocid, river_prefix, river_suffix
+                                        FROM tenders_flood
+                                        INNER JOIN tender_titles
+                                        ON tender_titles.ocid = tenders_flood.ocid
+                                        WHERE river_position IS NOT NULL;''', conn)
 
-    river_ids = []
-    flood_df = psql.read_sql('''SELECT tenders_flood.ocid, tender_title
-                                    FROM assam_procurements.tenders_flood
-                                    INNER JOIN assam_procurements.tenders_static
-                                    ON tenders_static.ocid = tenders_flood.ocid;''', conn)
-
-    assam_rivers = psql.read_sql('''SELECT * FROM assam_procurements.assam_rivers;''', conn)
-    l = list(assam_rivers.id)
-
-    for k in flood_df['tender_title']:
-        words = k.replace(',', ' ').replace('_', ' '). \
-            replace('.', ' ').replace('ofriver', 'river'). \
-            replace('Riverbank', 'river').replace('-', ' ').replace('RIVER', 'river').replace('River', 'river').split()
-        try:
-            idx = words.index('river')
-        except:
-            river_ids.append(None)
-            continue
-        prefix = words[idx - 1]
-        try:
-            suffix = words[idx + 1]
-        except:
-            suffix = None
-
-        scores_p = []
-        scores_s = []
-
-
-
-        for j in list(assam_rivers.river_name):
-            scores_p.append(fuzz.ratio(j, prefix))
-            scores_s.append(fuzz.ratio(j, suffix))
-
-        if max(scores_p) >= max(scores_s):
-            river_id = l[scores_p.index(max(scores_p))]
-        elif max(scores_p) < max(scores_s):
-            river_id = l[scores_s.index(max(scores_s))]
-        else:
-            river_id = None
+        river_ids, river_names = river_registry.rivers(conn.cursor())
+
+    metrics.add('rows_in', len(flood_df))
 
-        river_ids.append(river_id)
-    flood_df['river_id'] = river_ids
-    flood_df['river_id'] = flood_df['river_id']
+    # Fuzzy matching against assam_rivers, sharded by ocid range
+    flood_df['river_id'] = run_sharded(match_rivers_shard, flood_df, river_ids, river_names)
 
-    flood_df = flood_df.drop(['tender_title'], axis=1)
+    flood_df = flood_df.drop(['river_prefix', 'river_suffix'], axis=1)
     flood_df = flood_df.dropna()
     flood_df['river_id'] = flood_df['river_id'].astype('int')
     tender_river_df = flood_df
     return tender_river_df
 
 @task
+@instrumented
 def create_tender_river_table(tender_river_df):
-    conn = psycopg2.connect(dbname=DB_NAME, user=DB_USER, password=DB_PASS, host=DB_HOST, port=5432)
-    cursor = conn.cursor()
-    cursor.execute("SET search_path TO assam_procurements")
-
-    create_table = '''CREATE TABLE IF NOT EXISTS assam_procurements.tender_river 
-                            (id SERIAL PRIMARY KEY,
-                            ocid varchar, river_id int,
-                            FOREIGN KEY (ocid) REFERENCES tenders_static(ocid),
-                            FOREIGN KEY (river_id) REFERENCES assam_rivers(id));'''
-    cursor.execute(create_table)
-    conn.commit()
-
-    tender_river_df.to_csv('data.csv', index=False, header=tender_river_df.columns, encoding='utf-8')
-    data = open('data.csv')
-
-    insert = ''' COPY tender_river(ocid, river_id) FROM STDIN WITH
-                            CSV
-                            HEADER
-                            DELIMITER AS ',';
-                            '''
-    cursor.copy_expert(sql=insert, file=data)
-    conn.commit()
-    data.close()
-
-    # Remove files on server
-    os.remove('data.csv')
-    conn.close()
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        create_table = '''CREATE TABLE IF NOT EXISTS tender_river 
+                                (id SERIAL PRIMARY KEY,
+                                ocid varchar, river_id int,
+                                FOREIGN KEY (ocid) REFERENCES tenders_static(ocid),
+                                FOREIGN KEY (river_id) REFERENCES assam_rivers(id));'''
+        cursor.execute(create_table)
+
+        # Replace the matches in one transaction, so readers see the old ones until the new ones are in.
+        # DELETE rather than TRUNCATE: TRUNCATE's ACCESS EXCLUSIVE lock would block every dashboard query that
+        # joins tender_river until the COPY commits; the dead rows are left to autovacuum.
+        cursor.execute("DELETE FROM tender_river;")
+        copy_to_table(cursor, tender_river_df, 'tender_river')
 
     return None
 
-with Flow('my_etl') as flow:
-    s3_key = Parameter(required=True,name='s3_key')
-    df = extract_from_s3(s3_key)
-    df_static, cols_table_1, df_updates, cols_table_2 = transform_into_schema(df)
-    intermediate1 = load_to_db_static(df_static,cols_table_1)
-    intermediate2 = load_to_db_updates(df_updates, cols_table_2)
-    flood_df = identify_flood_tenders(upstream_tasks=[intermediate1])
-    intermediate3 = create_tender_flood_table(flood_df)
+
+# The final stages run after both the flood/river stages and the update load, and also when the loads were skipped
+@task(skip_on_upstream_skip=False)
+@instrumented
+def update_flood_rollups():
+    with get_connection() as conn:
+        changed = refresh_rollups(conn.cursor())
+    prefect.context.get('logger').info('Flood rollups: {} tenders changed'.format(changed))
+
+@task(skip_on_upstream_skip=False)
+@instrumented
+def refresh_read_models():
+    with get_connection() as conn:
+        refresh_flood_view(conn.cursor())
+
+def log_connection_stats(flow, old_state, new_state):
+    # Connection setup time saved by reusing pooled connections during this flow run
+    if new_state.is_finished():
+        prefect.context.get('logger').info('DB connection pool: {}'.format(pool_stats()))
+    return new_state
+
+# Independent branches run concurrently on threads; CPU-bound stages shard across processes themselves
+with Flow('my_etl', state_handlers=[log_connection_stats],
+          executor=LocalDaskExecutor(scheduler='threads', num_workers=max(ETL_WORKERS, 2))) as flow:
+    s3_key = Parameter(name='s3_key', default=None)
+    s3_keys = Parameter(name='s3_keys', default=None)  # backfills: several files loaded in one pass
+    s3_prefix = Parameter(name='s3_prefix', default=None)  # or every file under a prefix
+    chunksize = Parameter(name='chunksize', default=None)  # rows per chunk; None loads the whole file at once
+    reprocess = Parameter(name='reprocess', default=False)  # load files again even if the manifest has them
+    keys = list_s3_keys(s3_key, s3_keys, s3_prefix)
+    pending = pending_files(keys, reprocess)
+    streaming = use_streaming(chunksize)
+    with case(streaming, True):
+        intermediate0 = stream_s3_to_db(pending, chunksize)
+        record_stage(pending, 'loaded', upstream_tasks=[intermediate0])
+    with case(streaming, False):
+        staged = stage_parquet(pending)
+        df = extract_from_s3(staged)
+        df_static, cols_table_1, df_updates, cols_table_2 = transform_into_schema(df)
+        intermediate1 = load_to_db_static(df_static,cols_table_1)
+        # tenders_update references tenders_static, so it loads after it -- alongside the flood stages
+        intermediate2 = load_to_db_updates(df_updates, cols_table_2, upstream_tasks=[intermediate1])
+        record_stage(pending, 'loaded', upstream_tasks=[intermediate1, intermediate2])
+    loaded = merge(intermediate0, intermediate1)
+    updated = merge(intermediate0, intermediate2)
+    flood_df, flood_high_water_mark, flood_state_read = identify_flood_tenders(upstream_tasks=[loaded])
+    intermediate3 = create_tender_flood_table(flood_df, flood_high_water_mark, flood_state_read)
     river_names_std = standardise_river_names(upstream_tasks=[intermediate3])
     intermediate4 = create_assam_rivers_table(river_names_std)
     tender_river_df = identify_river_from_title(upstream_tasks=[intermediate4])
-    create_tender_river_table(tender_river_df)
+    intermediate5 = create_tender_river_table(tender_river_df)
+    record_stage(keys, 'classified', upstream_tasks=[intermediate5])
+    update_flood_rollups(upstream_tasks=[intermediate5, updated])
+    refresh_read_models(upstream_tasks=[intermediate5, updated])
 
 
 #flow.visualize()
 
 #flow.run(parameters={'s3_key':'CivicDataLab_ Assam Public Procurement Data _ #not-to-be-shared - ocds_mapped_compiled.csv'})
 
-flow.register(project_name='my_project')
\ No newline at end of file
+if __name__ == '__main__':
+    flow.register(project_name='my_project')
\ No newline at end of file
@@ -0,0 +1,148 @@
+import time
+import datetime
+import threading
+import functools
+
+from decouple import config
+
+from db import get_connection
+
+
+REFRESH_CHANNEL = 'flood_tenders_refreshed'
+READ_CACHE_TTL = config('READ_CACHE_TTL', default=300, cast=float)  # seconds
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# One row per flood tender with its river and latest status, so the read endpoints never join at request time.
+# published_at falls back to the release date so every row has a sort key for keyset pagination.
+FLOOD_VIEW = '''CREATE MATERIALIZED VIEW flood_tenders_view AS
+                SELECT f.ocid, s.tender_title AS title, s.tender_externalreference AS reference,
+                       s.tender_procuringentity_name AS procuring_entity, s.tender_value_amount AS value_amount,
+                       coalesce(s.tender_datepublished, s.date, 'epoch') AS published_at,
+                       r.river_id, a.river_name,
+                       u.tender_stage AS latest_stage, u.tender_status AS latest_status, u.date AS status_date
+                FROM tenders_flood f
+                INNER JOIN tenders_static s USING (ocid)
+                LEFT JOIN (SELECT DISTINCT ON (ocid) ocid, river_id FROM tender_river ORDER BY ocid, id) r USING (ocid)
+                LEFT JOIN assam_rivers a ON a.id = r.river_id
+                LEFT JOIN tenders_latest_status u USING (ocid)
+                WITH DATA;'''
+FLOOD_VIEW_INDEXES = [
+    # The unique index is also what REFRESH ... CONCURRENTLY needs
+    '''CREATE UNIQUE INDEX IF NOT EXISTS flood_tenders_view_ocid ON flood_tenders_view (ocid);''',
+    '''CREATE INDEX IF NOT EXISTS flood_tenders_view_published
+       ON flood_tenders_view (published_at DESC, ocid DESC);''',
+    '''CREATE INDEX IF NOT EXISTS flood_tenders_view_river
+       ON flood_tenders_view (river_id, published_at DESC, ocid DESC);''',
+    '''CREATE INDEX IF NOT EXISTS flood_tenders_view_status
+       ON flood_tenders_view (latest_status, published_at DESC, ocid DESC);''',
+]
+FLOOD_COLUMNS = ['ocid', 'title', 'reference', 'procuring_entity', 'value_amount', 'published_at',
+                 'river_id', 'river_name', 'latest_stage', 'latest_status', 'status_date']
+
+
+def refresh_flood_view(cursor):
+    # Builds the view on first use and refreshes it afterwards without blocking readers.
+    # The NOTIFY goes out when the transaction commits, so API caches are dropped once the new rows are visible.
+    cursor.execute("SELECT to_regclass('flood_tenders_view') IS NULL;")
+    if cursor.fetchone()[0]:
+        cursor.execute(FLOOD_VIEW)
+    else:
+        cursor.execute('''REFRESH MATERIALIZED VIEW CONCURRENTLY flood_tenders_view;''')
+    for index in FLOOD_VIEW_INDEXES:
+        cursor.execute(index)
+    cursor.execute('''NOTIFY {};'''.format(REFRESH_CHANNEL))
+
+
+class TTLCache:
+    # Small in-process cache for the read endpoints. Entries expire after `ttl` seconds; clear() drops everything.
+    def __init__(self, ttl, maxsize=1024):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                return None
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            if len(self._entries) >= self.maxsize:
+                del self._entries[next(iter(self._entries))]  # oldest entry
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+
+    def clear(self, *args):
+        with self._lock:
+            self._entries.clear()
+
+    def cached(self, fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            key = (fn.__name__, args, tuple(sorted(kwargs.items())))
+            value = self.get(key)
+            if value is None:
+                value = fn(*args, **kwargs)
+                self.set(key, value)
+            return value
+        return wrapper
+
+
+read_cache = TTLCache(READ_CACHE_TTL)
+
+
+def encode_cursor(row):
+    return '{}|{}'.format(row['published_at'].isoformat(), row['ocid'])
+
+
+def decode_cursor(cursor):
+    # Raises ValueError for anything encode_cursor didn't produce
+    published_at, ocid = cursor.split('|', 1)
+    return datetime.datetime.fromisoformat(published_at), ocid
+
+
+@read_cache.cached
+def flood_tenders(river_id=None, published_from=None, published_to=None, status=None, after=None, limit=PAGE_SIZE):
+    # One page of flood tenders, newest first. `after` is the `next` cursor of the previous page.
+    conditions, params = [], []
+    if river_id is not None:
+        conditions.append('river_id = %s')
+        params.append(river_id)
+    if published_from is not None:
+        conditions.append('published_at >= %s')
+        params.append(published_from)
+    if published_to is not None:
+        conditions.append('published_at < %s')
+        params.append(published_to)
+    if status is not None:
+        conditions.append('latest_status = %s')
+        params.append(status)
+    if after is not None:
+        conditions.append('(published_at, ocid) < (%s, %s)')
+        params.extend(decode_cursor(after))
+
+    where = 'WHERE ' + ' AND '.join(conditions) if conditions else ''
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''SELECT {} FROM flood_tenders_view {}
+                          ORDER BY published_at DESC, ocid DESC LIMIT %s;'''.format(', '.join(FLOOD_COLUMNS), where),
+                       params + [limit + 1])
+        rows = [dict(zip(FLOOD_COLUMNS, row)) for row in cursor.fetchall()]
+
+    items = rows[:limit]
+    return {'items': items, 'next': encode_cursor(items[-1]) if len(rows) > limit else None}
+
+
+@read_cache.cached
+def rivers():
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''SELECT a.id, a.river_name, count(v.ocid) FROM assam_rivers a
+                          LEFT JOIN flood_tenders_view v ON v.river_id = a.id
+                          GROUP BY a.id, a.river_name ORDER BY a.river_name;''')
+        return [{'river_id': river_id, 'river_name': name, 'flood_tenders': count}
+                for river_id, name, count in cursor.fetchall()]
@@ -0,0 +1,92 @@
+import threading
+
+from psycopg2.extras import execute_values
+
+
+# NOTIFY sent when rivers are added or merged, so API processes can rebuild their river index
+RIVERS_CHANNEL = 'assam_rivers_changed'
+
+def normalise_river_name(name):
+    # Same expression as the assam_rivers_name_key index
+    return name.lower()
+
+
+class RiverRegistry:
+    # assam_rivers plus an in-process name -> id cache. Names are unique ignoring case, new names are added
+    # with a single bulk upsert, and the river-matching stage reads the cache instead of the table.
+    def __init__(self):
+        self._ids = {}  # normalised name -> id
+        self._names = {}  # id -> name as stored
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def create_table(cursor):
+        cursor.execute('''CREATE TABLE IF NOT EXISTS assam_rivers (id serial PRIMARY KEY, river_name varchar);''')
+        cursor.execute("SELECT to_regclass('assam_rivers_name_key') IS NULL;")
+        if cursor.fetchone()[0]:
+            # Tables from before the unique index can hold the same river more than once: point matches at
+            # the first row of each name and drop the others
+            cursor.execute("SELECT to_regclass('tender_river') IS NOT NULL;")
+            if cursor.fetchone()[0]:
+                cursor.execute('''UPDATE tender_river SET river_id = d.keep
+                                  FROM (SELECT id, min(id) OVER (PARTITION BY lower(river_name)) AS keep
+                                        FROM assam_rivers) d
+                                  WHERE tender_river.river_id = d.id AND d.id <> d.keep;''')
+            cursor.execute('''DELETE FROM assam_rivers a USING assam_rivers b
+                              WHERE lower(a.river_name) = lower(b.river_name) AND a.id > b.id;''')
+            cursor.execute('''CREATE UNIQUE INDEX assam_rivers_name_key ON assam_rivers (lower(river_name));''')
+            cursor.execute('''NOTIFY {};'''.format(RIVERS_CHANNEL))
+
+    def _remember(self, rows):
+        for river_id, name in rows:
+            self._ids[normalise_river_name(name)] = river_id
+            self._names[river_id] = name
+
+    def load(self, cursor):
+        # Fills the cache from the table; a no-op once loaded
+        with self._lock:
+            if not self._loaded:
+                cursor.execute('''SELECT id, river_name FROM assam_rivers;''')
+                self._remember(cursor.fetchall())
+                self._loaded = True
+
+    def clear(self, *args):
+        with self._lock:
+            self._ids.clear()
+            self._names.clear()
+            self._loaded = False
+
+    def register(self, cursor, names):
+        # Adds the names not in assam_rivers yet, in one round trip, and returns {name: id} for all of them.
+        # The no-op DO UPDATE makes existing rows come back in RETURNING too.
+        self.load(cursor)
+        unique = {}
+        for name in sorted(names):
+            unique.setdefault(normalise_river_name(name), name)
+        if unique:
+            rows = execute_values(cursor, '''INSERT INTO assam_rivers (river_name) VALUES %s
+                                             ON CONFLICT ((lower(river_name)))
+                                             DO UPDATE SET river_name = assam_rivers.river_name
+                                             RETURNING id, river_name;''',
+                                  [(name,) for name in unique.values()], page_size=len(unique), fetch=True)
+            with self._lock:
+                added = any(normalise_river_name(name) not in self._ids for _, name in rows)
+                self._remember(rows)
+            if added:
+                # Delivered when the transaction commits
+                cursor.execute('''NOTIFY {};'''.format(RIVERS_CHANNEL))
+        return {name: self._ids[normalise_river_name(name)] for name in names}
+
+    def id_of(self, name):
+        return self._ids.get(normalise_river_name(name))
+
+    def rivers(self, cursor):
+        # (ids, names) of every registered river in id order, for RiverIndex
+        self.load(cursor)
+        with self._lock:
+            ids = sorted(self._names)
+            return ids, [self._names[river_id] for river_id in ids]
+
+
+river_registry = RiverRegistry()
@@ -0,0 +1,150 @@
+from collections import Counter
+import numpy as np
+from fuzzywuzzy import fuzz
+
+
+# Words picked up next to 'river' that are not river names
+NON_RIVER_WORDS = ['Bank', 'Training', 'Erosion', 'Front', 'Course', 'District', 'River', 'Embankment']
+
+
+def candidate_river(prefix, suffix):
+    # Best guess at the river name from the words either side of 'river', used to build the river registry
+    if suffix is None:
+        suffix = 'River'  # This is manually removed later
+
+    if prefix in ['samoka']:
+        return prefix
+    elif suffix in ['brahmaputra', 'kollong']:
+        return suffix
+    # These were the only rivers with lower case initials.
+    elif (suffix[0].isupper()) & (len(suffix) >= 4):
+        return suffix
+    elif (prefix[0].isupper()) & (len(prefix) >= 4):
+        return prefix
+    return None
+
+
+def char_counts(strings, alphabet):
+    counts = np.zeros((len(strings), len(alphabet)), dtype=np.int16)
+    for row, string in enumerate(strings):
+        for char in string:
+            col = alphabet.get(char)
+            if col is not None:
+                counts[row, col] += 1
+    return counts
+
+
+def ratio_bounds(counts_a, lengths_a, counts_b, lengths_b):
+    # Upper bound of fuzz.ratio for every pair of rows in a and b. fuzz.ratio is 2*M/(len(a)+len(b)) and the
+    # matched characters M can't exceed the per-character overlap of the two strings. That overlap,
+    # sum(min(a, b)) over characters, is computed as sum over k of ([a >= k] @ [b >= k].T) matrix products.
+    overlap = np.zeros((len(counts_a), len(counts_b)), dtype=np.float32)
+    levels = min(counts_a.max(initial=0), counts_b.max(initial=0))
+    for level in range(1, levels + 1):
+        overlap += (counts_a >= level).astype(np.float32) @ (counts_b >= level).astype(np.float32).T
+    return 200.0 * overlap / np.maximum(lengths_a[:, None] + lengths_b[None, :], 1)
+
+
+def cluster_names(names, threshold=80, batch_size=256):
+    # Single pass clustering of spelling variants: candidate pairs are blocked by length and character
+    # overlap, pairs scoring >= threshold are joined with union-find, and each cluster is named after its
+    # most frequent spelling (alphabetical on ties). Returns a mapping of every name to its canonical name.
+    frequency = Counter(name for name in names if name is not None)
+    tokens = sorted(frequency, key=lambda name: (len(name), name))
+    alphabet = {char: i for i, char in enumerate(sorted(set(''.join(tokens))))}
+    counts = char_counts(tokens, alphabet)
+    lengths = np.array([len(token) for token in tokens], dtype=np.int32)
+    parent = list(range(len(tokens)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for start in range(0, len(tokens), batch_size):
+        end = min(start + batch_size, len(tokens))
+        # Tokens are sorted by length, and 2*len(a)/(len(a)+len(b)) must reach the threshold (less rounding)
+        max_length = lengths[end - 1] * (201 - threshold) / (threshold - 1)
+        stop = int(np.searchsorted(lengths, max_length, side='right'))
+        bounds = ratio_bounds(counts[start:end], lengths[start:end], counts[start:stop], lengths[start:stop])
+        for i, j in zip(*np.nonzero(bounds + 1 >= threshold)):
+            i, j = start + i, start + j
+            if j > i and fuzz.ratio(tokens[i], tokens[j]) >= threshold:
+                parent[find(i)] = find(j)
+
+    clusters = {}
+    for i, token in enumerate(tokens):
+        clusters.setdefault(find(i), []).append(token)
+    canonical = {}
+    for members in clusters.values():
+        name = min(members, key=lambda member: (-frequency[member], member))
+        for member in members:
+            canonical[member] = name
+    return canonical
+
+
+def standard_river_names(contexts):
+    # Distinct river names from (prefix, suffix) pairs of titles that mention a river, with spelling variants merged
+    canonical = cluster_names([candidate_river(prefix, suffix) for prefix, suffix in contexts])
+    return set(canonical.values()) - set(NON_RIVER_WORDS)
+
+
+class RiverIndex:
+    # Finds the assam_rivers entry with the highest fuzz.ratio for a token without scoring every river.
+    # Score bounds for a whole batch of tokens are computed at once in numpy, and fuzz.ratio is only called
+    # on rivers whose bound can still beat (or tie) the best score found so far. Results are the same as a
+    # full linear scan.
+    BATCH_SIZE = 256
+
+    def __init__(self, river_ids, river_names):
+        self.river_ids = list(river_ids)
+        self.river_names = list(river_names)
+        names = [name if isinstance(name, str) else '' for name in self.river_names]
+        self.alphabet = {char: i for i, char in enumerate(sorted(set(''.join(names))))}
+        self.counts = char_counts(names, self.alphabet)
+        self.lengths = np.array([len(name) for name in names], dtype=np.int32)
+        self.memo = {}  # token -> (score, position in river_ids)
+
+    def _bounds(self, tokens):
+        # Upper bound of fuzz.ratio for every (token, river) pair, shape len(tokens) x len(rivers)
+        lengths = np.array([len(token) for token in tokens], dtype=np.int32)
+        return ratio_bounds(char_counts(tokens, self.alphabet), lengths, self.counts, self.lengths)
+
+    def _best(self, token, bounds):
+        best_score, best_pos = -1, None
+        for pos in np.argsort(-bounds, kind='stable'):
+            if bounds[pos] + 1 < best_score:
+                break  # no remaining river can reach the best score, even after rounding
+            score = fuzz.ratio(self.river_names[pos], token)
+            if score > best_score or (score == best_score and pos < best_pos):
+                best_score, best_pos = score, pos
+        return best_score, best_pos
+
+    def lookup(self, tokens):
+        # Resolve every token not seen before, in batches; repeated tokens are answered from the memo
+        new = [token for token in dict.fromkeys(tokens) if token is not None and token not in self.memo]
+        for start in range(0, len(new), self.BATCH_SIZE):
+            batch = new[start:start + self.BATCH_SIZE]
+            for token, bounds in zip(batch, self._bounds(batch)):
+                self.memo[token] = self._best(token, bounds)
+
+    def score(self, token):
+        if token is None:
+            return 0, 0  # fuzz.ratio scores a missing word 0 against every river
+        if token not in self.memo:
+            self.lookup([token])
+        return self.memo[token]
+
+    def best(self, prefix, suffix):
+        # (river id, score) for the better scoring of the words before and after 'river'; the prefix wins ties
+        if not self.river_ids:
+            return None, None
+        score_p, pos_p = self.score(prefix)
+        score_s, pos_s = self.score(suffix)
+        if score_p >= score_s:
+            return self.river_ids[pos_p], score_p
+        return self.river_ids[pos_s], score_s
+
+    def match(self, prefix, suffix):
+        return self.best(prefix, suffix)[0]
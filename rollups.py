@@ -0,0 +1,73 @@
+# Flood spend per river x month and per procuring entity x month. flood_rollup_members keeps the state each
+# flood tender was last counted in; every refresh diffs the current state against it and only recomputes the
+# (group, month) cells that a new, removed or changed tender was or is in. That covers new loads, status
+# changes, river re-matches and a full reclassification alike.
+
+CREATE_TABLES = [
+    '''CREATE TABLE IF NOT EXISTS flood_rollup_members (ocid varchar PRIMARY KEY, month date, river_id int,
+       procuring_entity varchar, amount numeric, status varchar);''',
+    '''CREATE TABLE IF NOT EXISTS flood_spend_river_month (river_id int, month date, tenders bigint,
+       spend numeric, status_mix jsonb, PRIMARY KEY (river_id, month));''',
+    '''CREATE TABLE IF NOT EXISTS flood_spend_entity_month (procuring_entity varchar, month date, tenders bigint,
+       spend numeric, status_mix jsonb, PRIMARY KEY (procuring_entity, month));''',
+]
+
+# Month is taken from the publish date, or the release date when there is none
+CURRENT_MEMBERS = '''CREATE TEMP TABLE flood_rollup_current ON COMMIT DROP AS
+                     SELECT f.ocid, date_trunc('month', coalesce(s.tender_datepublished, s.date, 'epoch'))::date AS month,
+                            r.river_id, coalesce(s.tender_procuringentity_name, '') AS procuring_entity,
+                            s.tender_value_amount AS amount, l.tender_status AS status
+                     FROM tenders_flood f
+                     INNER JOIN tenders_static s USING (ocid)
+                     LEFT JOIN (SELECT DISTINCT ON (ocid) ocid, river_id FROM tender_river ORDER BY ocid, id) r
+                     USING (ocid)
+                     LEFT JOIN tenders_latest_status l USING (ocid);'''
+
+CHANGED_MEMBERS = '''CREATE TEMP TABLE flood_rollup_changed ON COMMIT DROP AS
+                     SELECT ocid, m.month AS old_month, m.river_id AS old_river_id,
+                            m.procuring_entity AS old_procuring_entity,
+                            c.month AS new_month, c.river_id AS new_river_id,
+                            c.procuring_entity AS new_procuring_entity
+                     FROM flood_rollup_current c FULL JOIN flood_rollup_members m USING (ocid)
+                     WHERE (c.month, c.river_id, c.procuring_entity, c.amount, c.status)
+                           IS DISTINCT FROM (m.month, m.river_id, m.procuring_entity, m.amount, m.status);'''
+
+APPLY_CHANGES = [
+    '''DELETE FROM flood_rollup_members WHERE ocid IN (SELECT ocid FROM flood_rollup_changed);''',
+    '''INSERT INTO flood_rollup_members SELECT c.* FROM flood_rollup_current c
+       INNER JOIN flood_rollup_changed USING (ocid);''',
+]
+
+# Cells to recompute, for each rollup: the group column and the table it lives in
+ROLLUPS = [('river_id', 'flood_spend_river_month'), ('procuring_entity', 'flood_spend_entity_month')]
+
+TOUCHED = '''SELECT old_{0}, old_month FROM flood_rollup_changed WHERE old_{0} IS NOT NULL AND old_month IS NOT NULL
+             UNION
+             SELECT new_{0}, new_month FROM flood_rollup_changed WHERE new_{0} IS NOT NULL AND new_month IS NOT NULL'''
+
+RECOMPUTE = [
+    '''DELETE FROM {1} WHERE ({0}, month) IN (%s);''' % TOUCHED,
+    '''INSERT INTO {1}
+       SELECT {0}, month, sum(tenders), sum(spend), jsonb_object_agg(coalesce(status, 'unknown'), tenders)
+       FROM (SELECT {0}, month, status, count(*) AS tenders, sum(amount) AS spend FROM flood_rollup_members
+             WHERE ({0}, month) IN (%s)
+             GROUP BY {0}, month, status) by_status
+       GROUP BY {0}, month;''' % TOUCHED,
+]
+
+
+def refresh_rollups(cursor):
+    # Returns the number of flood tenders whose contribution changed
+    for statement in CREATE_TABLES:
+        cursor.execute(statement)
+    cursor.execute(CURRENT_MEMBERS)
+    cursor.execute(CHANGED_MEMBERS)
+    cursor.execute('''SELECT count(*) FROM flood_rollup_changed;''')
+    changed = cursor.fetchone()[0]
+    if changed:
+        for statement in APPLY_CHANGES:
+            cursor.execute(statement)
+        for column, table in ROLLUPS:
+            for statement in RECOMPUTE:
+                cursor.execute(statement.format(column, table))
+    return changed
@@ -0,0 +1,122 @@
+from psycopg2.extras import Json
+
+from db import SCHEMA_NAME
+
+
+# Postgres type names -> the names PSQL_TYPES uses
+TYPE_NAMES = {'character varying': 'varchar',
+              'text': 'varchar',
+              'integer': 'int',
+              'bigint': 'bigint',
+              'numeric': 'numeric',
+              'boolean': 'boolean',
+              'timestamp without time zone': 'timestamp'}
+# Types a column can be widened to without losing values, narrowest first. Anything else widens to varchar.
+WIDER_TYPES = {'int': ['bigint', 'numeric', 'varchar'],
+               'bigint': ['numeric', 'varchar'],
+               'numeric': ['varchar'],
+               'boolean': ['varchar'],
+               'timestamp': ['varchar']}
+# Type for a new column that has no values yet
+UNTYPED = 'varchar'
+
+
+def create_catalog(cursor):
+    # One row per version of each table: its columns after the version was applied and the DDL that got it there
+    cursor.execute("SELECT to_regclass('schema_catalog') IS NULL;")
+    if cursor.fetchone()[0]:
+        cursor.execute('''CREATE SCHEMA IF NOT EXISTS {}'''.format(SCHEMA_NAME))
+        cursor.execute('''CREATE TABLE IF NOT EXISTS schema_catalog (table_name varchar, version int,
+                          columns jsonb NOT NULL, migration text[] NOT NULL,
+                          applied_at timestamptz NOT NULL DEFAULT now(),
+                          PRIMARY KEY (table_name, version));''')
+
+
+def catalog_columns(cursor, table_name):
+    # {column: type} of the latest version, or None for a table the catalog doesn't know
+    cursor.execute('''SELECT columns FROM schema_catalog WHERE table_name = %s
+                      ORDER BY version DESC LIMIT 1;''', (table_name,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def table_columns(cursor, table_name):
+    # {column: type} as the table actually is
+    cursor.execute('''SELECT attname, format_type(atttypid, atttypmod) FROM pg_attribute
+                      WHERE attrelid = %s::regclass AND attnum > 0 AND NOT attisdropped
+                      ORDER BY attnum;''', (table_name,))
+    return {name: TYPE_NAMES.get(data_type, data_type) for name, data_type in cursor.fetchall()}
+
+
+def widened(current, incoming):
+    # The type to change a `current` column to so it also holds `incoming` values, or None if it already does
+    if incoming is None or current == incoming or current not in WIDER_TYPES:
+        return None
+    if incoming in WIDER_TYPES[current]:
+        return incoming
+    if current in WIDER_TYPES.get(incoming, []):
+        return None
+    return 'varchar'
+
+
+def migrations(table_name, current, columns, managed):
+    # The minimal DDL to take a table with `current` columns to one that can load `columns`: new columns are
+    # added and narrower types widened. Columns are never dropped or narrowed.
+    statements = []
+    for name, data_type in columns.items():
+        if name not in current:
+            statements.append('''ALTER TABLE {} ADD COLUMN {} {}'''.format(table_name, name, data_type or UNTYPED))
+        elif widened(current[name], data_type):
+            statements.append('''ALTER TABLE {} ALTER COLUMN {} TYPE {}'''.format(
+                table_name, name, widened(current[name], data_type)))
+    for name, definition in managed.items():
+        if name not in current:
+            statements.append('''ALTER TABLE {} ADD COLUMN {} {}'''.format(table_name, name, definition))
+    return statements
+
+
+def drop_dependent_views(cursor, table_name):
+    # Postgres won't retype a column a view reads. Materialized views are read models the flow rebuilds at
+    # the end of the run, so they are dropped; a plain view still makes the ALTER fail.
+    cursor.execute('''SELECT DISTINCT dependent.oid::regclass::text FROM pg_depend
+                      INNER JOIN pg_rewrite ON pg_rewrite.oid = pg_depend.objid
+                      INNER JOIN pg_class dependent ON dependent.oid = pg_rewrite.ev_class
+                      WHERE pg_depend.refobjid = %s::regclass AND dependent.oid <> pg_depend.refobjid
+                      AND dependent.relkind = 'm';''', (table_name,))
+    for (view,) in cursor.fetchall():
+        cursor.execute('''DROP MATERIALIZED VIEW IF EXISTS {} CASCADE;'''.format(view))
+
+
+def sync_table(cursor, table_name, columns, create_table, managed=None):
+    # Makes `table_name` able to load a frame with `columns` ({column: type}, None for a column with no values).
+    # create_table is the CREATE TABLE statement with {} for the column definitions; managed are columns the
+    # pipeline fills itself ({column: definition}) that loaded frames don't carry.
+    # Returns the new catalog version, or None when the table already matched -- then the only statements
+    # run are reads of the catalog, and no lock is taken on the table.
+    managed = managed or {}
+    create_catalog(cursor)
+    cursor.execute('''SELECT to_regclass(%s) IS NOT NULL;''', (table_name,))
+    exists = cursor.fetchone()[0]
+    current = catalog_columns(cursor, table_name)
+    if exists and current is not None and not migrations(table_name, current, columns, managed):
+        return None
+
+    # Another flow may be migrating the same table: wait for it and start from what the table is now
+    cursor.execute('''SELECT pg_advisory_xact_lock(hashtext(%s));''', ('schema_catalog.' + table_name,))
+    cursor.execute('''SELECT to_regclass(%s) IS NOT NULL;''', (table_name,))
+    if cursor.fetchone()[0]:
+        statements = migrations(table_name, table_columns(cursor, table_name), columns, managed)
+        if any(' TYPE ' in statement for statement in statements):
+            drop_dependent_views(cursor, table_name)
+    else:
+        definitions = ['{} {}'.format(name, data_type or UNTYPED) for name, data_type in columns.items()]
+        definitions += ['{} {}'.format(name, definition) for name, definition in managed.items()]
+        statements = [create_table.format(', '.join(definitions))]
+    for statement in statements:
+        cursor.execute(statement)
+
+    cursor.execute('''INSERT INTO schema_catalog (table_name, version, columns, migration)
+                      SELECT %s, coalesce(max(version), 0) + 1, %s, %s FROM schema_catalog WHERE table_name = %s
+                      RETURNING version;''',
+                   (table_name, Json(table_columns(cursor, table_name)), statements, table_name))
+    return cursor.fetchone()[0]
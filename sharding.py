@@ -0,0 +1,47 @@
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from decouple import config
+
+from classifier import flood_classifier
+from rivers import RiverIndex
+from titles import river_contexts
+
+
+# Worker processes for the CPU-bound stages. Inputs smaller than SHARD_MIN_ROWS stay in the calling
+# process, where starting the pool would cost more than it saves.
+ETL_WORKERS = config('ETL_WORKERS', default=os.cpu_count() or 1, cast=int)
+SHARD_MIN_ROWS = config('SHARD_MIN_ROWS', default=50000, cast=int)
+
+
+def ocid_shards(df, n_shards):
+    # Contiguous ocid ranges of about the same number of rows
+    order = np.argsort(df['ocid'].to_numpy(dtype=object), kind='stable')
+    return [df.iloc[rows] for rows in np.array_split(order, n_shards) if len(rows)]
+
+
+def run_sharded(fn, df, *args):
+    # fn(shard, *args) returns a Series indexed like its shard. Shards run in a process pool and the
+    # results are put back in df's row order, so the output is the same for any number of workers.
+    if ETL_WORKERS < 2 or len(df) < SHARD_MIN_ROWS:
+        return fn(df, *args)
+    shards = ocid_shards(df, ETL_WORKERS)
+    # spawn rather than fork: the flow runs tasks on threads, and a forked child can inherit held locks
+    with ProcessPoolExecutor(len(shards), mp_context=multiprocessing.get_context('spawn')) as pool:
+        results = list(pool.map(fn, shards, *[[arg] * len(shards) for arg in args]))
+    return pd.concat(results).loc[df.index]
+
+
+def classify_shard(df):
+    return flood_classifier.classify_frame(df)
+
+
+def match_rivers_shard(df, river_ids, river_names):
+    # Each worker indexes the rivers once and scores every distinct word next to 'river' once, in batches
+    index = RiverIndex(river_ids, river_names)
+    contexts = river_contexts(df)
+    index.lookup([word for context in contexts for word in context])
+    return pd.Series([index.match(prefix, suffix) for prefix, suffix in contexts], index=df.index, dtype=object)
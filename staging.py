@@ -0,0 +1,28 @@
+import io
+
+import pyarrow.parquet as pq
+
+
+PARQUET_SUFFIX = '.parquet'
+PARQUET_COMPRESSION = 'zstd'
+
+
+def parquet_key(s3_key):
+    # The typed copy sits next to the raw upload: tenders/2022-05.csv -> tenders/2022-05.csv.parquet.
+    # The extension is kept, so a.csv and a.txt get copies of their own.
+    return s3_key + PARQUET_SUFFIX
+
+
+def is_parquet_key(s3_key):
+    return s3_key.endswith(PARQUET_SUFFIX)
+
+
+def to_parquet_bytes(df):
+    data = io.BytesIO()
+    df.to_parquet(data, index=False, compression=PARQUET_COMPRESSION)
+    return data.getvalue()
+
+
+def read_parquet(body):
+    # One GET for the whole object: the flow reads every column, so ranged reads would only add requests
+    return pq.read_table(io.BytesIO(body.read())).to_pandas()
@@ -0,0 +1,113 @@
+import numpy as np
+import pandas as pd
+
+
+# Raw OCDS-style headers; transform_into_schema turns them into tender_value_amount etc.
+COLUMNS = ['ocid', 'date', 'tender/stage', 'tender/status', 'tender/title', 'tender/externalReference',
+           'tender/procurementMethod', 'tender/procuringEntity/name', 'buyer/name', 'tender/value/amount',
+           'tender/datePublished', 'tender/bidOpening/date', 'tender/milestones', 'tender/milestones/dueDate']
+
+RIVERS = ['Brahmaputra', 'Dhansiri', 'Jiadhal', 'Subansiri', 'Beki', 'Manas', 'Kopili', 'Kollong', 'Jinjiram',
+          'Pagladia', 'Puthimari', 'Barak', 'Katakhal', 'Dikhow', 'Disang', 'Burhidihing', 'Ranganadi', 'Gadadhar',
+          'Champamati', 'Sankosh', 'Bhogdoi', 'Kulsi', 'Kushiyara', 'Longai', 'Jhanji', 'Dikrong', 'Buroi']
+PLACES = ['Guwahati', 'Dibrugarh', 'Jorhat', 'Silchar', 'Tezpur', 'Nagaon', 'Barpeta', 'Dhemaji', 'Lakhimpur',
+          'Majuli', 'Goalpara', 'Kokrajhar', 'Sivasagar', 'Golaghat', 'Morigaon', 'Nalbari', 'Karimganj']
+DEPARTMENTS = ['Water Resources Department', 'Public Works Roads Department', 'Assam State Disaster Management Authority',
+               'Public Health Engineering Department', 'Irrigation Department', 'Guwahati Municipal Corporation',
+               'Education Department', 'Health and Family Welfare Department', 'Soil Conservation Department',
+               'Brahmaputra Board', 'Inland Water Transport Department', 'Power Distribution Company']
+METHODS = ['open', 'limited', 'selective', 'direct']
+STAGES = [('tender', 'active'), ('tender', 'complete'), ('award', 'active'), ('award', 'complete'),
+          ('contract', 'active'), ('tender', 'cancelled')]
+
+FLOOD_TITLES = ['Protection of {place} town from the floods of river {river}',
+                'Anti erosion measures to protect {place} area from erosion of {river} River',
+                'Raising and strengthening of {river} river embankment near {place}',
+                'Restoration of flood damaged embkt along right bank of river {river}',
+                'Construction of RCC Bridge No. {n} over River {river} at {place}',
+                'Emergency measures on {river} River at {place} under SDRF',
+                'Construction of Storm water drain at {place} Ward No. {n}',
+                'Desiltation of {river} river channel near {place}',
+                'Repair of sluice gate on {river} RIVER dyke at {place}']
+OTHER_TITLES = ['Construction of Boys Hostel at {place} College',
+                'Supply of computer hardware for {place} District office',
+                'Hiring of vehicle with Driver for {place} Circle office',
+                'Installation of Flood Light at {place} Stadium',
+                'Improvement of road from {place} to NH-{n}',
+                'Annual maintenance of Floodlight system at {place} ISBT',
+                'Construction of Anganwadi Centre No. {n} at {place}',
+                'Supply of medicines to {place} Civil Hospital']
+
+
+def misspell(words, rng, rate):
+    # Drop, swap or double a character in a share of the words
+    words = np.asarray(words, dtype=object).copy()
+    for i in np.nonzero(rng.random(len(words)) < rate)[0]:
+        word = words[i]
+        j = rng.integers(1, len(word) - 1)
+        op = rng.integers(3)
+        if op == 0:
+            words[i] = word[:j] + word[j + 1:]
+        elif op == 1:
+            words[i] = word[:j - 1] + word[j] + word[j - 1] + word[j + 1:]
+        else:
+            words[i] = word[:j] + word[j] + word[j:]
+    return words
+
+
+def timestamps(rng, n, start='2016-04-01', days=6 * 365):
+    offsets = pd.to_timedelta(rng.integers(0, days * 24 * 3600, n), unit='s')
+    return pd.Timestamp(start, tz='UTC') + offsets
+
+
+def generate_tenders(n_rows, seed=0, flood_share=0.3, duplicate_share=0.08, misspell_rate=0.15):
+    # Assam-style OCDS tender rows. A share of the rows repeat an earlier ocid with a later date and
+    # stage/status, the way status updates show up in the monthly dumps.
+    rng = np.random.default_rng(seed)
+    n_unique = max(1, int(n_rows * (1 - duplicate_share)))
+    ocid_numbers = np.concatenate([np.arange(n_unique), rng.integers(0, n_unique, n_rows - n_unique)])
+    ocids = pd.Series(ocid_numbers).map('ocds-assam-{:08d}'.format)
+
+    flood = rng.random(n_unique) < flood_share
+    templates = np.where(flood, rng.choice(FLOOD_TITLES, n_unique), rng.choice(OTHER_TITLES, n_unique))
+    rivers = misspell(rng.choice(RIVERS, n_unique), rng, misspell_rate)
+    places = rng.choice(PLACES, n_unique)
+    numbers = rng.integers(1, 300, n_unique)
+    titles = [template.format(river=river, place=place, n=n)
+              for template, river, place, n in zip(templates, rivers, places, numbers)]
+    references = ['{}/{}/{}/{}'.format(place[:3].upper(), 'FLOOD' if is_flood else 'GEN', n, 2016 + n % 7)
+                  for place, is_flood, n in zip(places, flood, numbers)]
+
+    published = timestamps(rng, n_unique)
+    unique = pd.DataFrame({
+        'tender/title': titles,
+        'tender/externalReference': references,
+        'tender/procurementMethod': rng.choice(METHODS, n_unique, p=[0.7, 0.15, 0.1, 0.05]),
+        'tender/procuringEntity/name': rng.choice(DEPARTMENTS, n_unique),
+        'buyer/name': rng.choice(DEPARTMENTS, n_unique),
+        'tender/value/amount': rng.lognormal(15, 1.5, n_unique).astype(np.int64),
+        'tender/datePublished': published,
+        'tender/bidOpening/date': published + pd.to_timedelta(rng.integers(7, 45, n_unique), unit='D'),
+        'tender/milestones': published + pd.to_timedelta(rng.integers(30, 365, n_unique), unit='D'),
+        'tender/milestones/dueDate': published + pd.to_timedelta(rng.integers(60, 730, n_unique), unit='D'),
+    })
+    df = unique.iloc[ocid_numbers].reset_index(drop=True)
+    df.insert(0, 'ocid', ocids)
+
+    # Repeated ocids move forward in time and through the stages
+    repeat = np.arange(n_rows) >= n_unique
+    stage_index = np.where(repeat, rng.integers(2, len(STAGES), n_rows), rng.integers(0, 2, n_rows))
+    df.insert(1, 'date', df['tender/datePublished'] + pd.to_timedelta(np.where(repeat, rng.integers(30, 400, n_rows), 0), unit='D'))
+    df.insert(2, 'tender/stage', [STAGES[i][0] for i in stage_index])
+    df.insert(3, 'tender/status', [STAGES[i][1] for i in stage_index])
+
+    # Shuffle so updates are spread through the file
+    df = df.sample(frac=1, random_state=seed).reset_index(drop=True)
+    return df[COLUMNS]
+
+
+def write_tenders_csv(path, n_rows, seed=0):
+    df = generate_tenders(n_rows, seed=seed)
+    date_format = '%Y-%m-%dT%H:%M:%SZ'
+    df.to_csv(path, index=False, date_format=date_format)
+    return path
@@ -0,0 +1,53 @@
+import threading
+
+from decouple import config
+
+from classifier import flood_classifier
+from db import get_connection
+from rivers import RiverIndex
+from river_registry import river_registry
+from titles import title_words, river_context
+
+
+CLASSIFY_MAX_BATCH = config('CLASSIFY_MAX_BATCH', default=100, cast=int)  # tenders per /classify request
+RIVER_MEMO_SIZE = 100000  # words scored against the rivers before the index starts afresh
+
+
+class TenderClassifier:
+    # Flood flag, keywords and river for single tenders with the same rules as identify_flood_tenders and
+    # identify_river_from_title. The keyword patterns are compiled at import and the rivers are indexed from
+    # assam_rivers by refresh(), so classifying never touches the database.
+    def __init__(self, classifier):
+        self.classifier = classifier
+        self.index = RiverIndex([], [])
+        self._lock = threading.Lock()
+
+    def refresh(self, *args):
+        # Indexes the rivers again; also the db.listen callback for RIVERS_CHANNEL.
+        # The new index replaces the old one in one assignment, so requests in flight keep a consistent one.
+        with self._lock:
+            river_registry.clear()
+            with get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT to_regclass('assam_rivers') IS NOT NULL;")
+                river_ids, river_names = river_registry.rivers(cursor) if cursor.fetchone()[0] else ([], [])
+            self.index = RiverIndex(river_ids, river_names)
+
+    def river(self, words):
+        index = self.index
+        if len(index.memo) > RIVER_MEMO_SIZE:
+            # Request titles bring new words without end: start a fresh index rather than grow the memo
+            index = self.index = RiverIndex(index.river_ids, index.river_names)
+        context = river_context(words)
+        return index.best(*context) if context else (None, None)
+
+    def classify(self, title, reference=None):
+        # Titles are normalised as tender_titles.title_words is at load time
+        words = title_words(title or '')
+        flood_related, keywords = self.classifier.match(' '.join(words), reference)
+        river_id, river_score = self.river(words)
+        return {'flood_related': flood_related, 'keywords': keywords,
+                'river_id': river_id, 'river_score': river_score}
+
+
+tender_classifier = TenderClassifier(flood_classifier)
@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+
+
+# Applied in order to every tender title before it is split into words
+REPLACEMENTS = [(',', ' '), ('_', ' '), ('.', ' '), ('ofriver', 'river'), ('Riverbank', 'river'), ('-', ' '),
+                ('RIVER', 'river'), ('River', 'river')]
+TITLE_COLUMNS = ['ocid', 'title_words', 'river_position', 'river_prefix', 'river_suffix']
+
+
+def title_words(title):
+    for old, new in REPLACEMENTS:
+        title = title.replace(old, new)
+    return title.split()
+
+
+def river_context(words):
+    # Words either side of the first 'river', or None when the title doesn't mention one
+    try:
+        idx = words.index('river')
+    except ValueError:
+        return None
+    prefix = words[idx - 1]
+    suffix = words[idx + 1] if idx + 1 < len(words) else None
+    return prefix, suffix
+
+
+def normalise_titles(ocids, titles):
+    # Vectorized version of title_words/river_context for a whole batch, one row per ocid.
+    # river_prefix follows words[idx - 1], so a title starting with 'river' takes its last word.
+    text = pd.Series(titles).fillna('').astype(str).reset_index(drop=True)
+    for old, new in REPLACEMENTS:
+        text = text.str.replace(old, new, regex=False)
+    words = text.str.split()
+    counts = words.str.len().to_numpy()
+
+    exploded = words.explode()
+    rows_of_words = exploded.index.to_numpy()
+    flat = exploded.to_numpy(dtype=object)
+    position = exploded.groupby(level=0).cumcount()
+    river = position[exploded.eq('river').to_numpy()].groupby(level=0).first()
+
+    rows = river.index.to_numpy(dtype=np.int64)
+    idx = river.to_numpy(dtype=np.int64)
+    first = np.searchsorted(rows_of_words, rows)
+    prefix = flat[first + np.where(idx > 0, idx - 1, counts[rows] - 1)]
+    has_suffix = idx + 1 < counts[rows]
+    suffix = np.where(has_suffix, flat[np.minimum(first + idx + 1, len(flat) - 1)], None)
+
+    result = pd.DataFrame({'ocid': pd.Series(ocids).to_numpy(),
+                           'title_words': words.str.join(' ').to_numpy(),
+                           'river_position': pd.Series(pd.NA, index=text.index, dtype='Int64'),
+                           'river_prefix': pd.Series(None, index=text.index, dtype=object),
+                           'river_suffix': pd.Series(None, index=text.index, dtype=object)})
+    result.loc[rows, 'river_position'] = idx
+    result.loc[rows, 'river_prefix'] = prefix
+    result.loc[rows, 'river_suffix'] = suffix
+    return result[TITLE_COLUMNS]
+
+
+def river_contexts(df):
+    # (prefix, suffix) pairs from tender_titles rows, with None for a missing suffix
+    suffixes = df['river_suffix'].astype(object).where(df['river_suffix'].notna(), None)
+    return list(zip(df['river_prefix'], suffixes))